@@ -0,0 +1,322 @@
+# chess_bot.py
+import copy
+import threading
+import time
+from chess_engine import mvv_lva
+from chess_eval import evaluate
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 64
+ASPIRATION_WINDOW = 50
+
+# transposition table bound types
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+
+class TranspositionTable:
+    def __init__(self, size=1 << 18):
+        # size is rounded down to a power of two so a slot is just key & mask
+        self.size = 1 << (size.bit_length() - 1)
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+        self.generation = 0
+
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, flag, move_id):
+        index = key & self.mask
+        old = self.entries[index]
+        # keep a deeper entry for another position unless it is left over from an older search
+        if old is None or old[0] == key or depth >= old[1] or old[5] != self.generation:
+            self.entries[index] = (key, depth, score, flag, move_id, self.generation)
+
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.generation = 0
+
+
+class SearchResult:
+    def __init__(self):
+        self.best_move = None
+        self.score = 0
+        self.depth = 0
+        self.nodes = 0
+        self.elapsed = 0.0
+        self.pv = []
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def pv_notation(self):
+        return " ".join(move.get_chess_notation() for move in self.pv)
+
+    def __str__(self):
+        return (f"depth {self.depth} score {self.score} nodes {self.nodes} "
+                f"nps {self.nps} time {self.elapsed:.2f}s pv {self.pv_notation()}")
+
+
+class SearchHandle:
+    def __init__(self, bot, gs, max_depth, node_limit, time_limit):
+        self.bot = bot
+        # the worker makes and unmakes moves on its own copy, so gs stays safe to draw meanwhile
+        self.position = copy.deepcopy(gs)
+        self.progress = None  # SearchResult as of the last completed depth
+        self.result = None  # SearchResult once the search has finished, unless it failed or was cancelled
+        self.error = None  # exception the search raised, if it failed
+        self.cancelled = False
+        self._thread = threading.Thread(target=self._run, args=(max_depth, node_limit, time_limit), daemon=True)
+        self._thread.start()
+
+    def _run(self, max_depth, node_limit, time_limit):
+        try:
+            result = self.bot.search(self.position, max_depth, node_limit, time_limit, self._report)
+        except Exception as error:  # e.g. a broken evaluator or book file; the caller decides what to do
+            self.error = error
+            return
+        if not self.cancelled:
+            self.result = result
+
+    def _report(self, result):
+        self.progress = result
+
+    @property
+    def nodes(self):
+        return self.bot.nodes
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def cancel(self):
+        # search() clears the stop flag when it starts, so keep setting it until the thread is gone
+        self.cancelled = True
+        while self._thread.is_alive():
+            self.bot.stop()
+            self._thread.join(0.01)
+
+
+class ChessBot:
+    def __init__(self, tt_size=1 << 18, book=None, tablebase=None, evaluator=None):
+        self.tt = TranspositionTable(tt_size)
+        self.evaluate = evaluator or evaluate  # static evaluation, e.g. NNUENetwork(path).evaluate
+        self.book = book  # OpeningBook consulted before searching, if any
+        self.tablebase = tablebase  # Tablebase probed at the root and inside the search, if any
+        self.nodes = 0
+        self.stopped = False
+        self.node_limit = None
+        self.deadline = None
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = {}
+        self.pv_table = [[] for _ in range(MAX_PLY + 1)]
+        self.move_buffers = [[] for _ in range(MAX_PLY)]  # one reusable move list per ply
+
+    def stop(self):
+        self.stopped = True
+
+    def start_search(self, gs, max_depth=MAX_PLY, node_limit=None, time_limit=None):
+        # same search as search(), run on a worker thread so the caller's loop keeps going
+        return SearchHandle(self, gs, max_depth, node_limit, time_limit)
+
+    def search(self, gs, max_depth=MAX_PLY, node_limit=None, time_limit=None, on_iteration=None):
+        # Iterative deepening; the result always holds the last fully searched depth.
+        # on_iteration, if given, is called with the SearchResult after every depth.
+        start = time.perf_counter()
+        self.nodes = 0
+        self.stopped = False
+        self.node_limit = node_limit
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = {}
+        self.tt.new_search()
+        checkmate, stalemate = gs.checkmate, gs.stalemate
+
+        result = SearchResult()
+        root_moves = gs.get_valid_moves()
+        if root_moves:
+            result.best_move = root_moves[0]
+        book_move = self.book.find_move(gs) if self.book is not None and root_moves else None
+        if book_move is not None:
+            result.best_move = book_move
+            result.pv = [book_move]
+            result.elapsed = time.perf_counter() - start
+            gs.checkmate, gs.stalemate = checkmate, stalemate
+            return result
+        if root_moves and self._tablebase_covers(gs):
+            # with the position in the tables there is nothing to search: play the perfect move
+            found = self.tablebase.best_move(gs)
+            if found is not None:
+                move, wdl, plies = found
+                result.best_move = move
+                result.pv = [move]
+                result.score = (MATE_SCORE - plies) * wdl
+                result.elapsed = time.perf_counter() - start
+                gs.checkmate, gs.stalemate = checkmate, stalemate
+                return result
+        score = 0
+        for depth in range(1, min(max_depth, MAX_PLY - 1) + 1):
+            if depth >= 4:
+                alpha, beta = score - ASPIRATION_WINDOW, score + ASPIRATION_WINDOW
+            else:
+                alpha, beta = -INFINITY, INFINITY
+            while True:
+                value = self._negamax(gs, depth, alpha, beta, 0)
+                if self.stopped:
+                    break
+                # a result outside the window only bounds the true score, so open that side and re-search
+                if value <= alpha:
+                    alpha = -INFINITY
+                elif value >= beta:
+                    beta = INFINITY
+                else:
+                    break
+            if self.stopped:
+                break
+            score = value
+            result.score = score
+            result.depth = depth
+            result.pv = list(self.pv_table[0])
+            if result.pv:
+                result.best_move = result.pv[0]
+            result.nodes = self.nodes
+            result.elapsed = time.perf_counter() - start
+            if on_iteration is not None:
+                on_iteration(result)
+            if not root_moves or abs(score) >= MATE_SCORE - MAX_PLY:
+                break
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        gs.checkmate, gs.stalemate = checkmate, stalemate
+        return result
+
+    def _tablebase_covers(self, gs):
+        return self.tablebase is not None and bin(gs.occupied).count("1") <= self.tablebase.max_pieces
+
+    def _out_of_budget(self):
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            self.stopped = True
+        elif self.deadline is not None and self.nodes & 1023 == 0 and time.perf_counter() >= self.deadline:
+            self.stopped = True
+        return self.stopped
+
+    def _negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        self.pv_table[ply] = []
+        if self._out_of_budget():
+            return 0
+        if ply > 0 and (gs.halfmove_clock >= 100 or gs.is_repetition()):
+            return 0  # a repeated position is scored as the draw it can be steered into
+
+        key = gs.zobrist_key
+        hash_move_id = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            hash_move_id = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                score = _score_from_tt(entry[2], ply)
+                flag = entry[3]
+                if flag == EXACT or (flag == LOWER_BOUND and score >= beta) or (flag == UPPER_BOUND and score <= alpha):
+                    return score
+
+        if ply > 0 and self._tablebase_covers(gs):
+            probe = self.tablebase.probe(gs)
+            if probe is not None:
+                wdl, plies = probe
+                return (MATE_SCORE - ply - plies) * wdl
+
+        in_check = gs.in_check()
+        if in_check and ply < MAX_PLY - 1:
+            depth += 1  # never drop into quiescence while in check
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self._quiescence(gs, alpha, beta, ply)
+
+        # moves arrive in stages (hash move, captures, killers, quiets), so a cutoff early in the
+        # list never pays for generating the rest
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for move in gs.staged_moves(hash_move_id, self.killers[ply], self.history):
+            gs.make_move(move)
+            score = -self._negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undo_move()
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                    if alpha >= beta:
+                        if move.piece_captured == "--":
+                            killers = self.killers[ply]
+                            if killers[0] != move.move_id:
+                                killers[1] = killers[0]
+                                killers[0] = move.move_id
+                            self.history[move.move_id] = self.history.get(move.move_id, 0) + depth * depth
+                        break
+        if best_move is None:
+            return -MATE_SCORE + ply if in_check else 0
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.tt.store(key, depth, _score_to_tt(best_score, ply), flag, best_move.move_id)
+        return best_score
+
+    def _quiescence(self, gs, alpha, beta, ply):
+        # captures and promotions only, so the static evaluation is never read mid-exchange
+        self.nodes += 1
+        self.pv_table[ply] = []
+        if self._out_of_budget():
+            return 0
+        stand_pat = self.evaluate(gs)
+        if stand_pat >= beta or ply >= MAX_PLY - 1:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        captures = gs.get_capture_moves(self.move_buffers[ply])
+        captures.sort(key=mvv_lva, reverse=True)
+        for move in captures:
+            if not gs.see_ge(move):
+                continue  # an exchange that loses material cannot raise alpha over the stand-pat score
+            gs.make_move(move)
+            score = -self._quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undo_move()
+            if self.stopped:
+                return 0
+            if score > alpha:
+                alpha = score
+                self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                if alpha >= beta:
+                    break
+        return alpha
+
+
+def _score_to_tt(score, ply):
+    # mate scores are stored relative to the node so they stay valid at any depth
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
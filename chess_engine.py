@@ -1,5 +1,164 @@
+import random
+import struct
+from collections import OrderedDict
+from chess_eval import (MIDGAME_VALUES, ENDGAME_VALUES, MIDGAME_TABLES, ENDGAME_TABLES, PHASE_VALUES,
+                        piece_square_scores)
+
+# Bitboards: bit (row * 8 + col) is set when a piece stands on board[row][col],
+# so a8 is bit 0 and h1 is bit 63.
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+WHITE, BLACK = 0, 1
+
+
+def _leaper_attacks(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        attacks = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                attacks |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(attacks)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_attacks(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _leaper_attacks(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# squares attacked by a pawn of each colour standing on a square
+PAWN_ATTACKS = (_leaper_attacks(((-1, -1), (-1, 1))), _leaper_attacks(((1, -1), (1, 1))))
+
+
+def _line_attacks(directions):
+    # For every square, map each relevant occupancy of the line through it (edge squares
+    # never block anything, so they are left out of the mask) to the squares a slider sees.
+    masks = []
+    tables = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        for dr, dc in directions:
+            rr, cc = r + dr, c + dc
+            while 0 <= rr + dr < 8 and 0 <= cc + dc < 8:
+                mask |= 1 << (rr * 8 + cc)
+                rr, cc = rr + dr, cc + dc
+        table = {}
+        blockers = 0
+        while True:
+            attacks = 0
+            for dr, dc in directions:
+                rr, cc = r + dr, c + dc
+                while 0 <= rr < 8 and 0 <= cc < 8:
+                    attacks |= 1 << (rr * 8 + cc)
+                    if blockers & (1 << (rr * 8 + cc)):
+                        break
+                    rr, cc = rr + dr, cc + dc
+            table[blockers] = attacks
+            blockers = (blockers - mask) & mask
+            if blockers == 0:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+RANK_MASKS, RANK_ATTACKS = _line_attacks(((0, -1), (0, 1)))
+FILE_MASKS, FILE_ATTACKS = _line_attacks(((-1, 0), (1, 0)))
+DIAG_MASKS, DIAG_ATTACKS = _line_attacks(((-1, -1), (1, 1)))
+ANTI_DIAG_MASKS, ANTI_DIAG_ATTACKS = _line_attacks(((-1, 1), (1, -1)))
+
+
+def _between_squares():
+    # BETWEEN[a][b]: the squares strictly between a and b when they share a line, else 0
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        for dr, dc in ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)):
+            between = 0
+            rr, cc = r + dr, c + dc
+            while 0 <= rr < 8 and 0 <= cc < 8:
+                table[sq][rr * 8 + cc] = between
+                between |= 1 << (rr * 8 + cc)
+                rr, cc = rr + dr, cc + dc
+    return table
+
+
+BETWEEN = _between_squares()
+ALL_SQUARES = (1 << 64) - 1
+BACK_RANKS = 0xFF | (0xFF << 56)
+
+# castling rights bits, in the order the Zobrist castling keys are indexed by
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+CASTLING_BITS = (WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE)
+# rights that survive a move from or to each square: a king or rook leaving home, or a rook captured there
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[0] = 15 & ~BLACK_QUEENSIDE  # a8
+CASTLING_MASKS[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)  # e8
+CASTLING_MASKS[7] = 15 & ~BLACK_KINGSIDE  # h8
+CASTLING_MASKS[56] = 15 & ~WHITE_QUEENSIDE  # a1
+CASTLING_MASKS[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)  # e1
+CASTLING_MASKS[63] = 15 & ~WHITE_KINGSIDE  # h1
+
+UNDO_FIELDS = 5  # captured piece, castling rights, en passant square, halfmove clock, hash
+
+# Position snapshots: 32 bytes of placement (a nibble per square, a8 first, 0 empty and 1-12 a
+# PIECES index plus one), castling rights with the side to move in bit 4 (set for black), the en
+# passant square (-1 if none) and both clocks. Every snapshot is SNAPSHOT_SIZE bytes, so batches
+# can be packed back to back into one buffer; SNAPSHOT_FIELDS is the same layout as a NumPy
+# structured dtype, e.g. np.dtype(SNAPSHOT_FIELDS).
+SNAPSHOT_STRUCT = struct.Struct("<32sBbHH")
+SNAPSHOT_SIZE = SNAPSHOT_STRUCT.size
+SNAPSHOT_FIELDS = [("placement", "V32"), ("flags", "u1"), ("ep_square", "i1"),
+                   ("halfmove_clock", "<u2"), ("fullmove_number", "<u2")]
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+MATERIAL_POINTS = (1, 3, 3, 5, 9, 0)  # pawn, knight, bishop, rook, queen, king
+
+# move flags and promotion codes packed into Move.move_id
+NORMAL, PROMOTION, EN_PASSANT, CASTLING = 0, 1, 2, 3
+PROMOTION_CODES = {'N': 0, 'B': 1, 'R': 2, 'Q': 3}
+
+# victim/attacker ranks for MVV-LVA ordering
+ORDER_VALUES = {'p': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+
+
+def rook_attacks(sq, occupied):
+    return RANK_ATTACKS[sq][occupied & RANK_MASKS[sq]] | FILE_ATTACKS[sq][occupied & FILE_MASKS[sq]]
+
+
+def bishop_attacks(sq, occupied):
+    return DIAG_ATTACKS[sq][occupied & DIAG_MASKS[sq]] | ANTI_DIAG_ATTACKS[sq][occupied & ANTI_DIAG_MASKS[sq]]
+
+
+def _zobrist_keys(count, rng):
+    return [rng.getrandbits(64) for _ in range(count)]
+
+
+# Fixed seed so every process derives the same keys and hashes can be shared between them.
+_zobrist_rng = random.Random(0x5EED)
+ZOBRIST_PIECES = [_zobrist_keys(64, _zobrist_rng) for _ in PIECES]
+ZOBRIST_CASTLING = _zobrist_keys(16, _zobrist_rng)  # indexed by the castling rights mask
+ZOBRIST_ENPASSANT = _zobrist_keys(8, _zobrist_rng)  # indexed by the en passant file
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.getrandbits(64)
+
+# evaluation terms added and taken away as pieces are put and removed, indexed like the bitboards
+MIDGAME_SCORES = [piece_square_scores(piece, MIDGAME_VALUES, MIDGAME_TABLES) for piece in PIECES]
+ENDGAME_SCORES = [piece_square_scores(piece, ENDGAME_VALUES, ENDGAME_TABLES) for piece in PIECES]
+PIECE_PHASES = [PHASE_VALUES[piece[1]] for piece in PIECES]
+SEE_VALUES = [MIDGAME_VALUES[piece[1]] for piece in PIECES]  # kings never get captured, so theirs is unused
+
+SNAPSHOT_CODES = {piece: i + 1 for i, piece in enumerate(PIECES)}
+SNAPSHOT_CODES["--"] = 0
+_nibble_pieces = ("--",) + PIECES + (None,) * 3
+SNAPSHOT_PAIRS = [(_nibble_pieces[byte & 15], _nibble_pieces[byte >> 4]) for byte in range(256)]
+
+
 class GameState:
-    def __init__(self):
+    accumulator = None  # chess_nnue.Accumulator kept in step with the pieces, when one is attached
+    move_cache = None  # optional MoveCache of legal move lists by position key
+
+    def __init__(self, fen=None):
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
@@ -12,302 +171,928 @@ class GameState:
         ]
         self.white_to_move = True
         self.move_log = []
-        self.white_king_location = (7, 4)
-        self.black_king_location = (0, 4)
         self.checkmate = False
         self.stalemate = False
-        self.enpassant_possible = ()  # coordinates for the square where en passant capture is possible
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                             self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+        self.draw_by_repetition = False  # set with checkmate and stalemate by get_valid_moves
+        self.draw_by_fifty_moves = False
+        self.ep_square = -1  # square where en passant capture is possible, -1 if none
+        self.castling_rights = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        self.halfmove_clock = 0  # plies since the last capture or pawn move
+        self.fullmove_number = 1
+        # One flat, preallocated list holds an entry of UNDO_FIELDS slots per ply: the captured
+        # piece, castling rights, en passant square, halfmove clock and hash from before the move.
+        self._undo_stack = [None] * (UNDO_FIELDS * 512)
+        self._zobrist_key = self.compute_zobrist_key()
+        if fen is not None:
+            self.load_fen(fen)
+
+    def load_fen(self, fen):
+        # replaces the whole position in place, dropping the move history; every field is checked
+        # before anything is changed, so a malformed FEN raises ValueError and leaves the position as is
+        fields = fen.split()
+        if not 1 <= len(fields) <= 6:
+            raise ValueError(f"invalid FEN: {fen!r}")
+        rows = []
+        for rank in fields[0].split('/'):
+            row = []
+            for ch in rank:
+                if ch in "12345678":
+                    row.extend(["--"] * int(ch))
+                elif ch in "pnbrqkPNBRQK":
+                    row.append(('w' if ch.isupper() else 'b') + (ch.upper() if ch.lower() != 'p' else 'p'))
+                else:
+                    raise ValueError(f"invalid FEN placement: {fields[0]}")
+            rows.append(row)
+        if len(rows) != 8 or any(len(row) != 8 for row in rows):
+            raise ValueError(f"invalid FEN placement: {fields[0]}")
+        pieces = [piece for row in rows for piece in row]
+        if pieces.count("wK") != 1 or pieces.count("bK") != 1:
+            raise ValueError(f"invalid FEN placement, each side needs one king: {fields[0]}")
+        if any(piece[1] == 'p' for piece in rows[0] + rows[7]):
+            raise ValueError(f"invalid FEN placement, pawn on a back rank: {fields[0]}")
+        side = fields[1] if len(fields) > 1 else 'w'
+        if side not in ('w', 'b'):
+            raise ValueError(f"invalid FEN side to move: {side}")
+        castling = fields[2] if len(fields) > 2 else '-'
+        if castling != '-' and (not castling or any(castling.count(letter) > 1 for letter in castling)
+                                or not set(castling) <= set("KQkq")):
+            raise ValueError(f"invalid FEN castling rights: {castling}")
+        enpassant = fields[3] if len(fields) > 3 else '-'
+        ep_rank = '6' if side == 'w' else '3'  # the square the pawn that just moved passed over
+        if enpassant == '-':
+            ep_square = -1
+        elif len(enpassant) == 2 and enpassant[0] in Move.files_to_cols and enpassant[1] == ep_rank:
+            ep_square = Move.ranks_to_rows[enpassant[1]] * 8 + Move.files_to_cols[enpassant[0]]
+        else:
+            raise ValueError(f"invalid FEN en passant square: {enpassant}")
+        clocks = fields[4:]
+        if any(not clock.isdigit() for clock in clocks) or (len(clocks) > 1 and int(clocks[1]) < 1):
+            raise ValueError(f"invalid FEN move counters: {' '.join(clocks)}")
+        self.board = rows
+        self.white_to_move = side == 'w'
+        self.castling_rights = sum(bit for letter, bit in zip("KQkq", CASTLING_BITS) if letter in castling)
+        self.ep_square = ep_square
+        self.halfmove_clock = int(clocks[0]) if clocks else 0
+        self.fullmove_number = int(clocks[1]) if len(clocks) > 1 else 1
+        self.move_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.draw_by_repetition = False
+        self.draw_by_fifty_moves = False
+        self._zobrist_key = self.compute_zobrist_key()
+
+    def get_fen(self):
+        rows = []
+        for r in range(8):
+            row = ""
+            empty = 0
+            for piece in self.squares[r * 8:r * 8 + 8]:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                letter = 'P' if piece[1] == 'p' else piece[1]
+                row += letter if piece[0] == 'w' else letter.lower()
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        castling = "".join(letter for letter, bit in zip("KQkq", CASTLING_BITS) if self.castling_rights & bit)
+        if self.ep_square >= 0:
+            enpassant = Move.cols_to_files[self.ep_square & 7] + Move.rows_to_ranks[self.ep_square >> 3]
+        else:
+            enpassant = '-'
+        return " ".join(("/".join(rows), 'w' if self.white_to_move else 'b', castling or '-', enpassant,
+                         str(self.halfmove_clock), str(self.fullmove_number)))
+
+    def to_bytes(self):
+        # fixed-size snapshot of the position (not its history), see SNAPSHOT_STRUCT
+        codes = SNAPSHOT_CODES
+        squares = self.squares
+        placement = bytes([codes[squares[sq]] | codes[squares[sq + 1]] << 4 for sq in range(0, 64, 2)])
+        flags = self.castling_rights | (0 if self.white_to_move else 16)
+        return SNAPSHOT_STRUCT.pack(placement, flags, self.ep_square, min(self.halfmove_clock, 0xFFFF),
+                                    self.fullmove_number)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        # a new position from a snapshot anywhere in a bytes-like buffer (bytes, mmap, shared
+        # memory, a NumPy array); skips __init__, which would first set up the start position
+        gs = cls.__new__(cls)
+        gs._undo_stack = [None] * (UNDO_FIELDS * 64)  # grows like any other undo stack
+        gs.load_bytes(data, offset)
+        return gs
+
+    def load_bytes(self, data, offset=0):
+        # replaces the whole position in place from a snapshot, dropping the move history
+        placement, flags, ep_square, halfmove_clock, fullmove_number = SNAPSHOT_STRUCT.unpack_from(data, offset)
+        squares = []
+        for byte in placement:
+            squares += SNAPSHOT_PAIRS[byte]
+        if None in squares:
+            raise ValueError("invalid position snapshot")
+        if self.accumulator is not None:
+            self.accumulator.stale = [True, True]
+        if self.move_cache is not None:
+            self.move_cache.clear()
+
+        # the same state the board setter builds piece by piece, accumulated in locals instead
+        bitboards = [0] * 12
+        piece_counts = [0] * 12
+        key = midgame = endgame = phase = 0
+        piece_index, zobrist, midgame_scores, endgame_scores = PIECE_INDEX, ZOBRIST_PIECES, MIDGAME_SCORES, ENDGAME_SCORES
+        for sq, piece in enumerate(squares):
+            if piece != "--":
+                index = piece_index[piece]
+                bitboards[index] |= 1 << sq
+                piece_counts[index] += 1
+                key ^= zobrist[index][sq]
+                midgame += midgame_scores[index][sq]
+                endgame += endgame_scores[index][sq]
+                phase += PIECE_PHASES[index]
+        white = bitboards[0] | bitboards[1] | bitboards[2] | bitboards[3] | bitboards[4] | bitboards[5]
+        black = bitboards[6] | bitboards[7] | bitboards[8] | bitboards[9] | bitboards[10] | bitboards[11]
+        self.squares = squares
+        self.bitboards = bitboards
+        self.piece_counts = piece_counts
+        self.occupancy = [white, black]
+        self.occupied = white | black
+        self.king_squares = [bitboards[5].bit_length() - 1, bitboards[11].bit_length() - 1]
+        self.midgame_score, self.endgame_score, self.phase = midgame, endgame, phase
+        self._board_view = None
+        self._attack_maps = [None, None]
+
+        self.white_to_move = not flags & 16
+        self.castling_rights = flags & 15
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        self.move_log = []
+        self.checkmate = self.stalemate = False
+        self.draw_by_repetition = self.draw_by_fifty_moves = False
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        self._zobrist_key = key ^ ZOBRIST_CASTLING[self.castling_rights] ^ self._enpassant_zobrist()
+
+    @property
+    def zobrist_key(self):
+        return self._zobrist_key
+
+    @property
+    def hash_log(self):
+        # key of the position before each move in move_log, plus the current one
+        stack = self._undo_stack
+        keys = [stack[ply * UNDO_FIELDS + 4] for ply in range(len(self.move_log))]
+        keys.append(self._zobrist_key)
+        return keys
+
+    def compute_zobrist_key(self):
+        # full recomputation; make_move and undo_move keep _zobrist_key up to date incrementally
+        key = 0
+        for sq, piece in self.occupied_squares():
+            key ^= ZOBRIST_PIECES[PIECE_INDEX[piece]][sq]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ ZOBRIST_CASTLING[self.castling_rights] ^ self._enpassant_zobrist()
+
+    def _enpassant_zobrist(self):
+        return ZOBRIST_ENPASSANT[self.ep_square & 7] if self.ep_square >= 0 else 0
+
+    @property
+    def enpassant_possible(self):
+        # (row, col) of the en passant square, or () when there is none
+        if self.ep_square < 0:
+            return ()
+        return (self.ep_square >> 3, self.ep_square & 7)
+
+    @enpassant_possible.setter
+    def enpassant_possible(self, square):
+        self.ep_square = square[0] * 8 + square[1] if square else -1
+
+    @property
+    def current_castling_rights(self):
+        rights = self.castling_rights
+        return CastleRights(bool(rights & WHITE_KINGSIDE), bool(rights & BLACK_KINGSIDE),
+                            bool(rights & WHITE_QUEENSIDE), bool(rights & BLACK_QUEENSIDE))
+
+    @current_castling_rights.setter
+    def current_castling_rights(self, rights):
+        self.castling_rights = (rights.wks * WHITE_KINGSIDE | rights.wqs * WHITE_QUEENSIDE |
+                                rights.bks * BLACK_KINGSIDE | rights.bqs * BLACK_QUEENSIDE)
+
+    @property
+    def white_king_location(self):
+        sq = self.king_squares[WHITE]
+        return (sq >> 3, sq & 7) if sq >= 0 else None
+
+    @property
+    def black_king_location(self):
+        sq = self.king_squares[BLACK]
+        return (sq >> 3, sq & 7) if sq >= 0 else None
+
+    @property
+    def board(self):
+        # 8x8 list view for the UI, rebuilt from the square list only after the position changed
+        if self._board_view is None:
+            self._board_view = [self.squares[r * 8:r * 8 + 8] for r in range(8)]
+        return self._board_view
+
+    @board.setter
+    def board(self, rows):
+        if self.accumulator is not None:
+            self.accumulator.stale = [True, True]
+        if self.move_cache is not None:
+            self.move_cache.clear()  # cached moves point at the square list being replaced
+        self.squares = ["--"] * 64
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]  # white pieces, black pieces
+        self.occupied = 0
+        self.piece_counts = [0] * 12
+        self._board_view = None
+        self._attack_maps = [None, None]
+        self._zobrist_key = 0
+        self.midgame_score = self.endgame_score = 0  # white minus black, see chess_eval
+        self.phase = 0
+        for r in range(8):
+            for c in range(8):
+                if rows[r][c] != "--":
+                    self._put_piece(rows[r][c], r * 8 + c)
+        self.king_squares = [self.bitboards[PIECE_INDEX['wK']].bit_length() - 1,
+                             self.bitboards[PIECE_INDEX['bK']].bit_length() - 1]
+
+    def _put_piece(self, piece, sq):
+        bit = 1 << sq
+        index = PIECE_INDEX[piece]
+        self.squares[sq] = piece
+        self.bitboards[index] |= bit
+        self.piece_counts[index] += 1
+        self._zobrist_key ^= ZOBRIST_PIECES[index][sq]
+        self.midgame_score += MIDGAME_SCORES[index][sq]
+        self.endgame_score += ENDGAME_SCORES[index][sq]
+        self.phase += PIECE_PHASES[index]
+        if self.accumulator is not None:
+            self.accumulator.add_piece(self, index, sq)
+        self.occupancy[index // 6] |= bit
+        self.occupied |= bit
+        self._board_view = None
+        self._attack_maps[WHITE] = self._attack_maps[BLACK] = None
+
+    def _remove_piece(self, sq):
+        piece = self.squares[sq]
+        bit = 1 << sq
+        index = PIECE_INDEX[piece]
+        self.squares[sq] = "--"
+        self.bitboards[index] ^= bit
+        self.piece_counts[index] -= 1
+        self._zobrist_key ^= ZOBRIST_PIECES[index][sq]
+        self.midgame_score -= MIDGAME_SCORES[index][sq]
+        self.endgame_score -= ENDGAME_SCORES[index][sq]
+        self.phase -= PIECE_PHASES[index]
+        if self.accumulator is not None:
+            self.accumulator.remove_piece(self, index, sq)
+        self.occupancy[index // 6] ^= bit
+        self.occupied ^= bit
+        self._board_view = None
+        self._attack_maps[WHITE] = self._attack_maps[BLACK] = None
+        return piece
 
     def make_move(self, move):
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        move_id = move.move_id
+        start = move_id & 63
+        end = (move_id >> 6) & 63
+        flag = move_id >> 14
+        squares = self.squares
+        # the pieces are read now, before the board changes, and stay on the move for undo_move
+        piece = squares[start]
+        if flag == EN_PASSANT:
+            captured = 'wp' if piece == 'bp' else 'bp'
+        else:
+            captured = squares[end]
+        move._piece_moved = piece
+        move._piece_captured = captured
+
+        # save everything the move overwrites in this ply's undo entry
+        stack = self._undo_stack
+        entry = len(self.move_log) * UNDO_FIELDS
+        if entry == len(stack):
+            stack.extend([None] * len(stack))  # only when a game outgrows the preallocated stack
+        stack[entry] = captured
+        stack[entry + 1] = self.castling_rights
+        stack[entry + 2] = self.ep_square
+        stack[entry + 3] = self.halfmove_clock
+        stack[entry + 4] = self._zobrist_key
+
+        # side, castling and en passant keys are swapped out here and back in once they are updated
+        self._zobrist_key ^= ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[self.castling_rights] ^ self._enpassant_zobrist()
+        self._remove_piece(start)
+        if captured != "--" and flag != EN_PASSANT:
+            self._remove_piece(end)
         self.move_log.append(move)
-        self.white_to_move = not self.white_to_move
-        
-        # update king's position if moved
-        if move.piece_moved == "wK":
-            self.white_king_location = (move.end_row, move.end_col)
-        elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
-            
+
         # pawn promotion
-        if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + 'Q'
-            
-        # en passant move
-        if move.is_enpassant_move:
-            self.board[move.start_row][move.end_col] = "--"  # capturing the pawn
-            
-        # update enpassant_possible variable
-        if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row) == 2:
-            self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+        if flag == PROMOTION:
+            self._put_piece(piece[0] + "NBRQ"[(move_id >> 12) & 3], end)
         else:
-            self.enpassant_possible = ()
-            
+            self._put_piece(piece, end)
+
+        # en passant move
+        if flag == EN_PASSANT:
+            self._remove_piece((start & 56) | (end & 7))  # capturing the pawn
+
         # castle move
-        if move.is_castle_move:
-            if move.end_col - move.start_col == 2:  # kingside castle
-                self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col+1]
-                self.board[move.end_row][move.end_col+1] = "--"
+        if flag == CASTLING:
+            if end > start:  # kingside castle
+                self._put_piece(self._remove_piece(end + 1), end - 1)
             else:  # queenside castle
-                self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2]
-                self.board[move.end_row][move.end_col-2] = "--"
-                
-        # update castling rights - whenever it's a rook or king move
-        self.update_castle_rights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                                 self.current_castling_rights.wqs, self.current_castling_rights.bqs))
+                self._put_piece(self._remove_piece(end - 2), end + 1)
+
+        # update king's position if moved
+        if piece[1] == 'K':
+            self.king_squares[WHITE if self.white_to_move else BLACK] = end
+
+        # a pawn that advanced two squares can be taken en passant on the square it skipped
+        if piece[1] == 'p' and (start - end == 16 or end - start == 16):
+            self.ep_square = (start + end) >> 1
+        else:
+            self.ep_square = -1
+
+        # any move from or to a king or rook home square clears the rights that depend on it
+        self.castling_rights &= CASTLING_MASKS[start] & CASTLING_MASKS[end]
+
+        if piece[1] == 'p' or captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        self._zobrist_key ^= ZOBRIST_CASTLING[self.castling_rights] ^ self._enpassant_zobrist()
+        if not self.white_to_move:
+            self.fullmove_number += 1
+        self.white_to_move = not self.white_to_move
 
     def undo_move(self):
         if len(self.move_log) != 0:
             move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            move_id = move.move_id
+            start = move_id & 63
+            end = (move_id >> 6) & 63
+            flag = move_id >> 14
+            piece = move._piece_moved
+            stack = self._undo_stack
+            entry = len(self.move_log) * UNDO_FIELDS
+            captured = stack[entry]
+            self._remove_piece(end)
+            self._put_piece(piece, start)
+            if captured != "--" and flag != EN_PASSANT:
+                self._put_piece(captured, end)
             self.white_to_move = not self.white_to_move
-            
+            if not self.white_to_move:
+                self.fullmove_number -= 1
+
             # update king's position if needed
-            if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
-            elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
-                
+            if piece[1] == 'K':
+                self.king_squares[WHITE if self.white_to_move else BLACK] = start
+
             # undo en passant move
-            if move.is_enpassant_move:
-                self.board[move.end_row][move.end_col] = "--"  # leave landing square blank
-                self.board[move.start_row][move.end_col] = move.piece_captured
-                self.enpassant_possible = (move.end_row, move.end_col)
-                
-            # undo a 2 square pawn advance
-            if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row) == 2:
-                self.enpassant_possible = ()
-                
-            # undo castling rights
-            self.castle_rights_log.pop()
-            self.current_castling_rights = self.castle_rights_log[-1]
-            
+            if flag == EN_PASSANT:
+                self._put_piece(captured, (start & 56) | (end & 7))
+
             # undo castle move
-            if move.is_castle_move:
-                if move.end_col - move.start_col == 2:  # kingside
-                    self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-1]
-                    self.board[move.end_row][move.end_col-1] = "--"
+            if flag == CASTLING:
+                if end > start:  # kingside
+                    self._put_piece(self._remove_piece(end - 1), end + 1)
                 else:  # queenside
-                    self.board[move.end_row][move.end_col-2] = self.board[move.end_row][move.end_col+1]
-                    self.board[move.end_row][move.end_col+1] = "--"
-                    
+                    self._put_piece(self._remove_piece(end + 1), end - 2)
+
+            # the rest of the position comes straight back from the undo entry
+            self.castling_rights = stack[entry + 1]
+            self.ep_square = stack[entry + 2]
+            self.halfmove_clock = stack[entry + 3]
+            self._zobrist_key = stack[entry + 4]
+
             self.checkmate = False
             self.stalemate = False
+            self.draw_by_repetition = False
+            self.draw_by_fifty_moves = False
 
-    def update_castle_rights(self, move):
-        if move.piece_moved == 'wK':
-            self.current_castling_rights.wks = False
-            self.current_castling_rights.wqs = False
-        elif move.piece_moved == 'bK':
-            self.current_castling_rights.bks = False
-            self.current_castling_rights.bqs = False
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.bks = False
-
-    def get_valid_moves(self):
-        temp_enpassant_possible = self.enpassant_possible
-        temp_castle_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                        self.current_castling_rights.wqs, self.current_castling_rights.bqs)
-        
-        moves = self.get_all_possible_moves()
-        if self.white_to_move:
-            self.get_castle_moves(self.white_king_location[0], self.white_king_location[1], moves)
+    def is_repetition(self, times=1):
+        # True once the current position has occurred `times` times before. Only positions since
+        # the last capture or pawn move can match, and only every other one has the same side to
+        # move, so this is a few integer compares against the hashes on the undo stack.
+        if self.halfmove_clock < 4:
+            return False
+        stack = self._undo_stack
+        key = self._zobrist_key
+        ply = len(self.move_log)
+        oldest = max(ply - self.halfmove_clock, 0)
+        for index in range((ply - 4) * UNDO_FIELDS + 4, oldest * UNDO_FIELDS + 3, -2 * UNDO_FIELDS):
+            if stack[index] == key:
+                times -= 1
+                if times == 0:
+                    return True
+        return False
+
+    def _update_draw_flags(self):
+        # the draws a player may claim; a mate delivered on the fiftieth move still counts
+        self.draw_by_fifty_moves = self.halfmove_clock >= 100 and not self.checkmate
+        self.draw_by_repetition = not self.checkmate and self.is_repetition(2)
+
+    def get_valid_moves(self, moves=None):
+        # Checkers and pins are found once, so every move emitted here is already legal
+        # and nothing has to be made and taken back to test it.
+        # A caller may pass its own list to be cleared and refilled instead of a new one.
+        if moves is None:
+            moves = []
         else:
-            self.get_castle_moves(self.black_king_location[0], self.black_king_location[1], moves)
-            
-        for i in range(len(moves)-1, -1, -1):
-            self.make_move(moves[i])
-            self.white_to_move = not self.white_to_move
-            if self.in_check():
-                moves.remove(moves[i])
-            self.white_to_move = not self.white_to_move
-            self.undo_move()
-            
+            del moves[:]
+        cache = self.move_cache
+        if cache is not None:
+            entry = cache.get(self._zobrist_key)
+            if entry is not None:
+                moves.extend(entry[0])  # copied so callers may reorder their list freely
+                self.checkmate, self.stalemate = entry[1], entry[2]
+                self._update_draw_flags()
+                return moves
+        context = self._legal_context()
+        self._add_legal_moves(context, moves)
+        checkers = context[5]
         if len(moves) == 0:
-            if self.in_check():
+            if checkers:
                 self.checkmate = True
             else:
                 self.stalemate = True
         else:
             self.checkmate = False
             self.stalemate = False
-            
-        self.enpassant_possible = temp_enpassant_possible
-        self.current_castling_rights = temp_castle_rights
+        self._update_draw_flags()
+        if cache is not None:
+            cache.put(self._zobrist_key, (tuple(moves), self.checkmate, self.stalemate, checkers != 0))
+        return moves
+
+    def get_capture_moves(self, moves=None):
+        # legal captures and promotions only, for quiescence search
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
+        return self._add_legal_moves(self._legal_context(), moves, quiets=False)
+
+    def staged_moves(self, hash_move_id=None, killers=(), history=None):
+        # Yields the legal moves one stage at a time: the hash move, captures and promotions that do
+        # not lose material by MVV-LVA, killers, losing captures, then the remaining quiet moves by
+        # history score. A stage is only generated once the consumer asks past the previous one, so
+        # a cutoff on the hash move or a capture never builds the quiet moves. The position must be
+        # the same at every resume.
+        context = self._legal_context()
+        if hash_move_id is not None:
+            hash_move = self._find_legal(context, hash_move_id)
+            if hash_move is not None:
+                yield hash_move
+
+        captures = self._add_legal_moves(context, [], quiets=False)
+        captures.sort(key=mvv_lva, reverse=True)
+        losing = []
+        for move in captures:
+            if move.move_id == hash_move_id:
+                continue
+            if self.see_ge(move):
+                yield move
+            else:
+                losing.append(move)
+
+        played = [hash_move_id]
+        for killer_id in killers:
+            if killer_id is not None and killer_id not in played:
+                killer = self._find_legal(context, killer_id, captures=False)
+                if killer is not None:
+                    played.append(killer_id)
+                    yield killer
+        for move in losing:
+            yield move
+
+        quiets = self._add_legal_moves(context, [], captures=False)
+        if history:
+            quiets.sort(key=lambda move: history.get(move.move_id, 0), reverse=True)
+        for move in quiets:
+            if move.move_id not in played:
+                yield move
+
+    def _find_legal(self, context, move_id, captures=True, quiets=True):
+        # the legal move with this id, found by generating only from its start square
+        start = move_id & 63
+        if not self.occupancy[context[0]] & (1 << start):
+            return None
+        for move in self._add_legal_moves(context, [], captures, quiets, 1 << start):
+            if move.move_id == move_id:
+                return move
+        return None
+
+    def _legal_context(self):
+        # (us, them, pawn step, king square, enemy attacks, checkers, king targets, check target,
+        # pinned pieces, pin rays) for the side to move, shared by every stage of generation
+        if self.white_to_move:
+            us, them, pawn_step = WHITE, BLACK, -8
+        else:
+            us, them, pawn_step = BLACK, WHITE, 8
+        bitboards = self.bitboards
+        squares = self.squares
+        occupied = self.occupied
+        own = self.occupancy[us]
+        enemy = self.occupancy[them]
+        offset = us * 6
+        enemy_offset = them * 6
+
+        king_sq = bitboards[offset + 5].bit_length() - 1
+        king_bit = 1 << king_sq
+        attacked = self.attacked_squares(them)
+        checkers = self._attackers_to(king_sq, them, occupied) if attacked & king_bit else 0
+        king_targets = KING_ATTACKS[king_sq] & ~own & ~attacked
+        # a checking slider also covers the squares behind the king on its line
+        sliders = checkers & ~bitboards[enemy_offset] & ~bitboards[enemy_offset + 1]
+        while sliders:
+            lsb = sliders & -sliders
+            sliders ^= lsb
+            sq = lsb.bit_length() - 1
+            if squares[sq][1] != 'R':
+                king_targets &= ~bishop_attacks(sq, occupied ^ king_bit)
+            if squares[sq][1] != 'B':
+                king_targets &= ~rook_attacks(sq, occupied ^ king_bit)
+
+        pinned = 0
+        pin_rays = {}
+        if checkers & (checkers - 1):
+            target = 0  # in double check only the king may move
+        else:
+            if checkers:
+                target = (checkers | BETWEEN[king_sq][checkers.bit_length() - 1]) & ~own
+            else:
+                target = ~own & ALL_SQUARES
+
+            # pieces pinned to the king may only move along the line to their pinner
+            snipers = ((rook_attacks(king_sq, enemy) & (bitboards[enemy_offset + 3] | bitboards[enemy_offset + 4])) |
+                       (bishop_attacks(king_sq, enemy) & (bitboards[enemy_offset + 2] | bitboards[enemy_offset + 4])))
+            while snipers:
+                lsb = snipers & -snipers
+                snipers ^= lsb
+                between = BETWEEN[king_sq][lsb.bit_length() - 1]
+                blockers = between & occupied
+                if blockers and not blockers & (blockers - 1):
+                    pinned |= blockers
+                    pin_rays[blockers.bit_length() - 1] = between | lsb
+        return us, them, pawn_step, king_sq, attacked, checkers, king_targets, target, pinned, pin_rays
+
+    def _add_legal_moves(self, context, moves, captures=True, quiets=True, origins=ALL_SQUARES):
+        # Appends the legal moves of one stage: captures (promotions and en passant included) and/or
+        # quiet moves (castling included), optionally only those starting on an origins square.
+        us, them, pawn_step, king_sq, attacked, checkers, king_targets, target, pinned, pin_rays = context
+        bitboards = self.bitboards
+        occupied = self.occupied
+        enemy = self.occupancy[them]
+        empty = ~occupied & ALL_SQUARES
+        offset = us * 6
+        wanted = (enemy if captures else 0) | (empty if quiets else 0)
+
+        if origins >> king_sq & 1:
+            self._add_moves(king_sq, king_targets & wanted, moves)
+            if quiets and not checkers:
+                self.get_castle_moves(king_sq >> 3, king_sq & 7, moves, attacked)
+        if not target:
+            return moves
+
+        piece_target = target & wanted
+        pieces = bitboards[offset + 1] & ~pinned & origins  # a pinned knight can never move
+        while pieces:
+            lsb = pieces & -pieces
+            pieces ^= lsb
+            sq = lsb.bit_length() - 1
+            self._add_moves(sq, KNIGHT_ATTACKS[sq] & piece_target, moves)
+
+        for kind, slider in ((2, bishop_attacks), (3, rook_attacks), (4, bishop_attacks), (4, rook_attacks)):
+            pieces = bitboards[offset + kind] & origins
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                sq = lsb.bit_length() - 1
+                self._add_moves(sq, slider(sq, occupied) & piece_target & pin_rays.get(sq, ALL_SQUARES), moves)
+
+        # pushes onto the back rank are promotions, which count as captures
+        push_mask = (BACK_RANKS if captures else 0) | (~BACK_RANKS & ALL_SQUARES if quiets else 0)
+        start_row = 6 if us == WHITE else 1
+        pieces = bitboards[offset] & origins
+        while pieces:
+            lsb = pieces & -pieces
+            pieces ^= lsb
+            sq = lsb.bit_length() - 1
+            targets = (1 << (sq + pawn_step)) & empty
+            if targets and sq >> 3 == start_row:
+                targets |= (1 << (sq + 2 * pawn_step)) & empty
+            targets &= push_mask
+            if captures:
+                targets |= PAWN_ATTACKS[us][sq] & enemy
+            self._add_pawn_moves(sq, targets & target & pin_rays.get(sq, ALL_SQUARES), moves)
+
+        ep_sq = self.ep_square
+        if captures and ep_sq >= 0:
+            captured_sq = ep_sq - pawn_step
+            pieces = PAWN_ATTACKS[them][ep_sq] & bitboards[offset] & origins
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                # Both pawns leave their squares at once, which can uncover an attack along the rank
+                # that neither pin detection nor the check mask sees, so test the resulting position.
+                after = (occupied ^ lsb ^ (1 << captured_sq)) | (1 << ep_sq)
+                if not self._attackers_to(king_sq, them, after) & ~(1 << captured_sq):
+                    moves.append(Move((lsb.bit_length() - 1) | ep_sq << 6 | EN_PASSANT << 14, self.squares))
         return moves
 
     def in_check(self):
+        if self.move_cache is not None:
+            entry = self.move_cache.peek(self._zobrist_key)
+            if entry is not None:
+                return entry[3]
         if self.white_to_move:
-            return self.square_under_attack(self.white_king_location[0], self.white_king_location[1])
+            return bool(self.attacked_squares(BLACK) & self.bitboards[PIECE_INDEX['wK']])
         else:
-            return self.square_under_attack(self.black_king_location[0], self.black_king_location[1])
+            return bool(self.attacked_squares(WHITE) & self.bitboards[PIECE_INDEX['bK']])
 
     def square_under_attack(self, r, c):
-        self.white_to_move = not self.white_to_move
-        opp_moves = self.get_all_possible_moves()
-        self.white_to_move = not self.white_to_move
-        for move in opp_moves:
-            if move.end_row == r and move.end_col == c:
-                return True
-        return False
+        enemy = BLACK if self.white_to_move else WHITE
+        return self._attackers_to(r * 8 + c, enemy, self.occupied) != 0
+
+    def attacked_squares(self, color):
+        # bitboard of every square the given side attacks, built once per position and
+        # shared by check detection, castling and the UI until the next change
+        attacks = self._attack_maps[color]
+        if attacks is None:
+            attacks = self._attack_maps[color] = self._attacked_by(color, self.occupied)
+        return attacks
+
+    def _attackers_to(self, sq, color, occupied):
+        # looks outward from sq along knight, pawn, king and sliding rays for pieces
+        # of the given side that attack it when the board holds `occupied`
+        offset = color * 6
+        bitboards = self.bitboards
+        return ((PAWN_ATTACKS[1 - color][sq] & bitboards[offset]) |
+                (KNIGHT_ATTACKS[sq] & bitboards[offset + 1]) |
+                (KING_ATTACKS[sq] & bitboards[offset + 5]) |
+                (bishop_attacks(sq, occupied) & (bitboards[offset + 2] | bitboards[offset + 4])) |
+                (rook_attacks(sq, occupied) & (bitboards[offset + 3] | bitboards[offset + 4])))
+
+    def _attacked_by(self, color, occupied):
+        # union of the squares the given side's pieces attack (pawn pushes are not attacks)
+        offset = color * 6
+        bitboards = self.bitboards
+        attacks = 0
+        for kind, table in ((0, PAWN_ATTACKS[color]), (1, KNIGHT_ATTACKS), (5, KING_ATTACKS)):
+            pieces = bitboards[offset + kind]
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                attacks |= table[lsb.bit_length() - 1]
+        for kind, slider in ((2, bishop_attacks), (3, rook_attacks), (4, bishop_attacks), (4, rook_attacks)):
+            pieces = bitboards[offset + kind]
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                attacks |= slider(lsb.bit_length() - 1, occupied)
+        return attacks
+
+    def see(self, move):
+        # Static exchange evaluation: the material the side making the move ends up with, in
+        # centipawns, once both sides have recaptured on its target square with their least valuable
+        # piece for as long as it pays. Only attack lookups are used; the board is not touched.
+        return self._exchange(move.move_id)
+
+    def see_ge(self, move, threshold=0):
+        # see(move) >= threshold, stopping as soon as the exchange is decided either way
+        move_id = move.move_id
+        flag = move_id >> 14
+        if flag == CASTLING:
+            return threshold <= 0
+        if flag != NORMAL:
+            return self._exchange(move_id) >= threshold
+        start = move_id & 63
+        end = (move_id >> 6) & 63
+        squares = self.squares
+        swap = (SEE_VALUES[PIECE_INDEX[squares[end]]] if squares[end] != "--" else 0) - threshold
+        if swap < 0:
+            return False
+        swap = SEE_VALUES[PIECE_INDEX[squares[start]]] - swap
+        if swap <= 0:
+            return True
+        bitboards = self.bitboards
+        diagonal = bitboards[2] | bitboards[4] | bitboards[8] | bitboards[10]
+        straight = bitboards[3] | bitboards[4] | bitboards[9] | bitboards[10]
+        occupied = self.occupied ^ (1 << start)
+        attackers = self._attackers_to(end, WHITE, occupied) | self._attackers_to(end, BLACK, occupied)
+        side = WHITE if squares[start][0] == 'w' else BLACK
+        result = 1  # 1 while the exchange so far meets the threshold for the moving side
+        while True:
+            side = 1 - side
+            attackers &= occupied
+            lsb, index = self._least_valuable(attackers & self.occupancy[side], side)
+            if not lsb:
+                break
+            result ^= 1
+            if index % 6 == 5:
+                # the king may only take last, when nothing defends the square any more
+                return bool(result ^ 1 if attackers & ~self.occupancy[side] else result)
+            swap = SEE_VALUES[index] - swap
+            if swap < result:
+                break
+            occupied ^= lsb
+            attackers |= (bishop_attacks(end, occupied) & diagonal) | (rook_attacks(end, occupied) & straight)
+        return bool(result)
+
+    def hanging_pieces(self, color):
+        # bitboard of the given side's pieces that the other side wins material by capturing
+        enemy = 1 - color
+        hanging = 0
+        pieces = self.occupancy[color] & ~self.bitboards[color * 6 + 5]
+        while pieces:
+            lsb = pieces & -pieces
+            pieces ^= lsb
+            sq = lsb.bit_length() - 1
+            attacker, _ = self._least_valuable(self._attackers_to(sq, enemy, self.occupied), enemy)
+            if attacker and self._exchange((attacker.bit_length() - 1) | sq << 6) > 0:
+                hanging |= lsb
+        return hanging
 
-    def get_all_possible_moves(self):
-        moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-                if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
-                    piece = self.board[r][c][1]
-                    if piece == 'p':
-                        self.get_pawn_moves(r, c, moves)
-                    elif piece == 'R':
-                        self.get_rook_moves(r, c, moves)
-                    elif piece == 'N':
-                        self.get_knight_moves(r, c, moves)
-                    elif piece == 'B':
-                        self.get_bishop_moves(r, c, moves)
-                    elif piece == 'Q':
-                        self.get_queen_moves(r, c, moves)
-                    elif piece == 'K':
-                        self.get_king_moves(r, c, moves)
+    def _least_valuable(self, attackers, color):
+        # (bit, piece index) of the cheapest of the given side's pieces among attackers
+        bitboards = self.bitboards
+        for index in range(color * 6, color * 6 + 6):
+            pieces = attackers & bitboards[index]
+            if pieces:
+                return pieces & -pieces, index
+        return 0, -1
+
+    def _exchange(self, move_id):
+        # swap-list resolution of the captures on one square; sliders lined up behind a piece that
+        # has just captured are found by recomputing slider attacks with it taken off the board
+        start = move_id & 63
+        end = (move_id >> 6) & 63
+        flag = move_id >> 14
+        if flag == CASTLING:
+            return 0
+        squares = self.squares
+        bitboards = self.bitboards
+        piece = PIECE_INDEX[squares[start]]
+        occupied = self.occupied ^ (1 << start)
+        if flag == EN_PASSANT:
+            gain = [SEE_VALUES[0]]
+            occupied ^= 1 << (end + (8 if piece == 0 else -8))
+        else:
+            gain = [SEE_VALUES[PIECE_INDEX[squares[end]]] if squares[end] != "--" else 0]
+        attacker_value = SEE_VALUES[piece]
+        if flag == PROMOTION:
+            attacker_value = MIDGAME_VALUES["NBRQ"[(move_id >> 12) & 3]]
+            gain[0] += attacker_value - SEE_VALUES[0]
+        diagonal = bitboards[2] | bitboards[4] | bitboards[8] | bitboards[10]
+        straight = bitboards[3] | bitboards[4] | bitboards[9] | bitboards[10]
+        attackers = (self._attackers_to(end, WHITE, occupied) | self._attackers_to(end, BLACK, occupied)) & occupied
+        side = BLACK if piece < 6 else WHITE
+        while True:
+            lsb, index = self._least_valuable(attackers & self.occupancy[side], side)
+            if not lsb or (index % 6 == 5 and attackers & self.occupancy[1 - side]):
+                break  # nothing left to recapture with, or only a king that would step into check
+            gain.append(attacker_value - gain[-1])
+            attacker_value = SEE_VALUES[index]
+            occupied ^= lsb
+            attackers = (attackers | (bishop_attacks(end, occupied) & diagonal) |
+                         (rook_attacks(end, occupied) & straight)) & occupied
+            side = 1 - side
+        # each side may decline to recapture, so fold the sequence back from its end
+        for d in range(len(gain) - 1, 0, -1):
+            gain[d - 1] = -max(-gain[d - 1], gain[d])
+        return gain[0]
+
+    def get_all_possible_moves(self, moves=None):
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
+        generators = (self.get_pawn_moves, self.get_knight_moves, self.get_bishop_moves,
+                      self.get_rook_moves, self.get_queen_moves, self.get_king_moves)
+        offset = 0 if self.white_to_move else 6
+        for kind in range(6):
+            pieces = self.bitboards[offset + kind]
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                sq = lsb.bit_length() - 1
+                generators[kind](sq >> 3, sq & 7, moves)
         return moves
 
+    def _add_moves(self, sq, targets, moves):
+        squares = self.squares
+        while targets:
+            lsb = targets & -targets
+            targets ^= lsb
+            moves.append(Move(sq | (lsb.bit_length() - 1) << 6, squares))
+
+    def _add_pawn_moves(self, sq, targets, moves):
+        if not targets & BACK_RANKS:
+            self._add_moves(sq, targets, moves)
+            return
+        squares = self.squares
+        while targets:
+            lsb = targets & -targets
+            targets ^= lsb
+            move_id = sq | (lsb.bit_length() - 1) << 6 | PROMOTION << 14
+            for code in (3, 2, 1, 0):  # queen first, the UI plays the first match
+                moves.append(Move(move_id | code << 12, squares))
+
     def get_pawn_moves(self, r, c, moves):
+        sq = r * 8 + c
         if self.white_to_move:
-            if self.board[r-1][c] == "--":
-                moves.append(Move((r, c), (r-1, c), self.board))
-                if r == 6 and self.board[r-2][c] == "--":
-                    moves.append(Move((r, c), (r-2, c), self.board))
-            if c-1 >= 0:
-                if self.board[r-1][c-1][0] == 'b':
-                    moves.append(Move((r, c), (r-1, c-1), self.board))
-                elif (r-1, c-1) == self.enpassant_possible:
-                    moves.append(Move((r, c), (r-1, c-1), self.board, is_enpassant_move=True))
-            if c+1 <= 7:
-                if self.board[r-1][c+1][0] == 'b':
-                    moves.append(Move((r, c), (r-1, c+1), self.board))
-                elif (r-1, c+1) == self.enpassant_possible:
-                    moves.append(Move((r, c), (r-1, c+1), self.board, is_enpassant_move=True))
+            color, enemy, step, start_row = WHITE, BLACK, -8, 6
         else:
-            if self.board[r+1][c] == "--":
-                moves.append(Move((r, c), (r+1, c), self.board))
-                if r == 1 and self.board[r+2][c] == "--":
-                    moves.append(Move((r, c), (r+2, c), self.board))
-            if c-1 >= 0:
-                if self.board[r+1][c-1][0] == 'w':
-                    moves.append(Move((r, c), (r+1, c-1), self.board))
-                elif (r+1, c-1) == self.enpassant_possible:
-                    moves.append(Move((r, c), (r+1, c-1), self.board, is_enpassant_move=True))
-            if c+1 <= 7:
-                if self.board[r+1][c+1][0] == 'w':
-                    moves.append(Move((r, c), (r+1, c+1), self.board))
-                elif (r+1, c+1) == self.enpassant_possible:
-                    moves.append(Move((r, c), (r+1, c+1), self.board, is_enpassant_move=True))
+            color, enemy, step, start_row = BLACK, WHITE, 8, 1
+        empty = ~self.occupied
+        targets = (1 << (sq + step)) & empty
+        if targets and r == start_row:
+            targets |= (1 << (sq + 2 * step)) & empty
+        targets |= PAWN_ATTACKS[color][sq] & self.occupancy[enemy]
+        self._add_pawn_moves(sq, targets, moves)
+        ep_sq = self.ep_square
+        if ep_sq >= 0:
+            if PAWN_ATTACKS[color][sq] & (1 << ep_sq):
+                moves.append(Move(sq | ep_sq << 6 | EN_PASSANT << 14, self.squares))
 
     def get_rook_moves(self, r, c, moves):
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        enemy_color = 'b' if self.white_to_move else 'w'
-        for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--":
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    elif end_piece[0] == enemy_color:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
+        sq = r * 8 + c
+        own = self.occupancy[WHITE if self.white_to_move else BLACK]
+        self._add_moves(sq, rook_attacks(sq, self.occupied) & ~own, moves)
 
     def get_knight_moves(self, r, c, moves):
-        knight_moves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        ally_color = 'w' if self.white_to_move else 'b'
-        for m in knight_moves:
-            end_row = r + m[0]
-            end_col = c + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
+        sq = r * 8 + c
+        own = self.occupancy[WHITE if self.white_to_move else BLACK]
+        self._add_moves(sq, KNIGHT_ATTACKS[sq] & ~own, moves)
 
     def get_bishop_moves(self, r, c, moves):
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
-        enemy_color = 'b' if self.white_to_move else 'w'
-        for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--":
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    elif end_piece[0] == enemy_color:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
+        sq = r * 8 + c
+        own = self.occupancy[WHITE if self.white_to_move else BLACK]
+        self._add_moves(sq, bishop_attacks(sq, self.occupied) & ~own, moves)
 
     def get_queen_moves(self, r, c, moves):
         self.get_rook_moves(r, c, moves)
         self.get_bishop_moves(r, c, moves)
 
     def get_king_moves(self, r, c, moves):
-        king_moves = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
-        ally_color = 'w' if self.white_to_move else 'b'
-        for i in range(8):
-            end_row = r + king_moves[i][0]
-            end_col = c + king_moves[i][1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
-
-    def get_castle_moves(self, r, c, moves):
-        if self.square_under_attack(r, c):
+        sq = r * 8 + c
+        own = self.occupancy[WHITE if self.white_to_move else BLACK]
+        self._add_moves(sq, KING_ATTACKS[sq] & ~own, moves)
+
+    def get_castle_moves(self, r, c, moves, attacked=None):
+        if attacked is None:
+            attacked = self.attacked_squares(BLACK if self.white_to_move else WHITE)
+        if attacked & (1 << (r * 8 + c)):
             return
-        if (self.white_to_move and self.current_castling_rights.wks) or (not self.white_to_move and self.current_castling_rights.bks):
-            self.get_kingside_castle_moves(r, c, moves)
-        if (self.white_to_move and self.current_castling_rights.wqs) or (not self.white_to_move and self.current_castling_rights.bqs):
-            self.get_queenside_castle_moves(r, c, moves)
+        rights = self.castling_rights
+        if rights & (WHITE_KINGSIDE if self.white_to_move else BLACK_KINGSIDE):
+            self.get_kingside_castle_moves(r, c, moves, attacked)
+        if rights & (WHITE_QUEENSIDE if self.white_to_move else BLACK_QUEENSIDE):
+            self.get_queenside_castle_moves(r, c, moves, attacked)
 
-    def get_kingside_castle_moves(self, r, c, moves):
-        if self.board[r][c+1] == '--' and self.board[r][c+2] == '--':
-            if not self.square_under_attack(r, c+1) and not self.square_under_attack(r, c+2):
-                moves.append(Move((r, c), (r, c+2), self.board, is_castle_move=True))
+    def get_kingside_castle_moves(self, r, c, moves, attacked):
+        sq = r * 8 + c
+        if self.squares[sq + 1] == '--' and self.squares[sq + 2] == '--':
+            if not attacked & (0b11 << (sq + 1)):  # neither square the king crosses is attacked
+                moves.append(Move(sq | (sq + 2) << 6 | CASTLING << 14, self.squares))
 
-    def get_queenside_castle_moves(self, r, c, moves):
-        if self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--':
-            if not self.square_under_attack(r, c-1) and not self.square_under_attack(r, c-2):
-                moves.append(Move((r, c), (r, c-2), self.board, is_castle_move=True))
+    def get_queenside_castle_moves(self, r, c, moves, attacked):
+        sq = r * 8 + c
+        if self.squares[sq - 1] == '--' and self.squares[sq - 2] == '--' and self.squares[sq - 3] == '--':
+            if not attacked & (0b11 << (sq - 2)):
+                moves.append(Move(sq | (sq - 2) << 6 | CASTLING << 14, self.squares))
 
     def find_king(self, color):
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                if self.board[r][c] == color + 'K':
-                    return (r, c)
-        return None
+        # make_move and undo_move keep both king locations current, so there is nothing to scan
+        return self.white_king_location if color == 'w' else self.black_king_location
+
+    def occupied_squares(self):
+        # (square, piece) for every piece on the board, visiting only occupied squares
+        occupied = self.occupied
+        while occupied:
+            lsb = occupied & -occupied
+            occupied ^= lsb
+            sq = lsb.bit_length() - 1
+            yield sq, self.squares[sq]
+
+    def piece_squares(self, piece):
+        # (row, col) of every piece of one kind, e.g. piece_squares('wN')
+        pieces = self.bitboards[PIECE_INDEX[piece]]
+        while pieces:
+            lsb = pieces & -pieces
+            pieces ^= lsb
+            sq = lsb.bit_length() - 1
+            yield (sq >> 3, sq & 7)
+
+    def material(self, color):
+        # classic 1/3/3/5/9 point count for 'w' or 'b', read from the running piece counts
+        offset = 0 if color == 'w' else 6
+        return sum(self.piece_counts[offset + kind] * MATERIAL_POINTS[kind] for kind in range(5))
 
 
 class CastleRights:
@@ -318,7 +1103,48 @@ class CastleRights:
         self.bqs = bqs
 
 
+class MoveCache:
+    # Bounded least-recently-used map from position key to (legal moves, checkmate, stalemate,
+    # in check), so positions reached again by undo/redo or a transposition skip generation.
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __deepcopy__(self, memo):
+        # a copied position starts with an empty cache rather than duplicating every move list
+        return MoveCache(self.capacity)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def peek(self, key):
+        # lookup that neither counts nor refreshes the entry
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
 class Move:
+    # A move is one integer laid out like a 16-bit move word: from square in bits 0-5,
+    # to square in bits 6-11, promotion piece in bits 12-13 and a flag in bits 14-15.
+    # Pieces moved and captured are only looked up when something asks for them.
+    __slots__ = ("move_id", "_squares", "_piece_moved", "_piece_captured")
+
     ranks_to_rows = {"1": 7, "2": 6, "3": 5, "4": 4,
                      "5": 3, "6": 2, "7": 1, "8": 0}
     rows_to_ranks = {v: k for k, v in ranks_to_rows.items()}
@@ -326,27 +1152,100 @@ class Move:
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_sq, end_sq, board, is_enpassant_move=False, is_castle_move=False):
-        self.start_row = start_sq[0]
-        self.start_col = start_sq[1]
-        self.end_row = end_sq[0]
-        self.end_col = end_sq[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
-        self.is_pawn_promotion = (self.piece_moved == 'wp' and self.end_row == 0) or (self.piece_moved == 'bp' and self.end_row == 7)
-        self.is_enpassant_move = is_enpassant_move
-        if self.is_enpassant_move:
-            self.piece_captured = 'wp' if self.piece_moved == 'bp' else 'bp'
-        self.is_castle_move = is_castle_move
-        self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+    def __init__(self, move_id, squares=None):
+        self.move_id = move_id
+        self._squares = squares  # square list of the position the move was generated in
+        self._piece_moved = None
+        self._piece_captured = None
+
+    @classmethod
+    def from_squares(cls, start_sq, end_sq, board, promotion_piece='Q'):
+        # builds a move from (row, col) pairs and an 8x8 board, e.g. two clicks in the UI
+        piece_moved = board[start_sq[0]][start_sq[1]]
+        piece_captured = board[end_sq[0]][end_sq[1]]
+        move_id = (start_sq[0] * 8 + start_sq[1]) | (end_sq[0] * 8 + end_sq[1]) << 6
+        if piece_moved[1] == 'p' and end_sq[0] in (0, 7):
+            move_id |= PROMOTION_CODES[promotion_piece] << 12 | PROMOTION << 14
+        elif piece_moved[1] == 'p' and start_sq[1] != end_sq[1] and piece_captured == "--":
+            move_id |= EN_PASSANT << 14
+            piece_captured = 'wp' if piece_moved == 'bp' else 'bp'
+        elif piece_moved[1] == 'K' and abs(start_sq[1] - end_sq[1]) == 2:
+            move_id |= CASTLING << 14
+        move = cls(move_id)
+        move._piece_moved = piece_moved
+        move._piece_captured = piece_captured
+        return move
+
+    @property
+    def start_row(self):
+        return (self.move_id & 63) >> 3
+
+    @property
+    def start_col(self):
+        return self.move_id & 7
+
+    @property
+    def end_row(self):
+        return (self.move_id >> 9) & 7
+
+    @property
+    def end_col(self):
+        return (self.move_id >> 6) & 7
+
+    @property
+    def is_pawn_promotion(self):
+        return self.move_id >> 14 == PROMOTION
+
+    @property
+    def is_enpassant_move(self):
+        return self.move_id >> 14 == EN_PASSANT
+
+    @property
+    def is_castle_move(self):
+        return self.move_id >> 14 == CASTLING
+
+    @property
+    def promotion_piece(self):
+        return "NBRQ"[(self.move_id >> 12) & 3] if self.move_id >> 14 == PROMOTION else None
+
+    @property
+    def piece_moved(self):
+        if self._piece_moved is None:
+            self._piece_moved = self._squares[self.move_id & 63]
+        return self._piece_moved
+
+    @property
+    def piece_captured(self):
+        # only valid while the position the move came from is on the board; make_move
+        # fills both pieces in, so a made move keeps them afterwards
+        if self._piece_captured is None:
+            if self.move_id >> 14 == EN_PASSANT:
+                self._piece_captured = 'wp' if self.piece_moved == 'bp' else 'bp'
+            else:
+                self._piece_captured = self._squares[(self.move_id >> 6) & 63]
+        return self._piece_captured
 
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.move_id == other.move_id
         return False
 
+    def __hash__(self):
+        return self.move_id
+
     def get_chess_notation(self):
-        return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        notation = self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        if self.is_pawn_promotion:
+            notation += self.promotion_piece.lower()
+        return notation
 
     def get_rank_file(self, r, c):
-        return self.cols_to_files[c] + self.rows_to_ranks[r]
\ No newline at end of file
+        return self.cols_to_files[c] + self.rows_to_ranks[r]
+
+
+def mvv_lva(move):
+    # most valuable victim first, then least valuable attacker; promotions count the new piece
+    victim = ORDER_VALUES[move.piece_captured[1]] if move.piece_captured != "--" else 0
+    if move.is_pawn_promotion:
+        victim += ORDER_VALUES[move.promotion_piece]
+    return victim * 10 - ORDER_VALUES[move.piece_moved[1]]
@@ -0,0 +1,133 @@
+# chess_eval.py
+# Tapered material and piece-square evaluation. GameState keeps the midgame score, endgame
+# score and game phase up to date as pieces are put and removed, so evaluate() only blends them.
+
+MIDGAME_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+ENDGAME_VALUES = {'p': 120, 'N': 300, 'B': 320, 'R': 520, 'Q': 940, 'K': 0}
+# how much each piece counts toward the midgame; the full starting set adds up to MAX_PHASE
+PHASE_VALUES = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+MAX_PHASE = 24
+
+# Piece-square tables from white's point of view, a8 first like GameState.squares.
+# Black pieces read them through sq ^ 56, which mirrors the board vertically.
+PAWN_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+]
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+]
+ROOK_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0,
+]
+QUEEN_TABLE = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20,
+]
+KING_MIDGAME_TABLE = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20,
+]
+# in the endgame pawns gain value as they advance and the king belongs in the centre
+PAWN_ENDGAME_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    15, 15, 15, 15, 15, 15, 15, 15,
+    5, 5, 5, 5, 5, 5, 5, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+KING_ENDGAME_TABLE = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+]
+MIDGAME_TABLES = {'p': PAWN_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE,
+                  'R': ROOK_TABLE, 'Q': QUEEN_TABLE, 'K': KING_MIDGAME_TABLE}
+ENDGAME_TABLES = {'p': PAWN_ENDGAME_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE,
+                  'R': ROOK_TABLE, 'Q': QUEEN_TABLE, 'K': KING_ENDGAME_TABLE}
+
+CHECK_INCREMENTAL = False  # debug: compare every evaluation against a full recompute
+
+
+def piece_square_scores(piece, values, tables):
+    # value plus table bonus of a piece on each square, negated for black so scores add up white minus black
+    kind = piece[1]
+    table = tables[kind]
+    if piece[0] == 'w':
+        return [values[kind] + table[sq] for sq in range(64)]
+    return [-(values[kind] + table[sq ^ 56]) for sq in range(64)]
+
+
+def compute_scores(gs):
+    # (midgame, endgame, phase) recomputed from scratch
+    midgame = endgame = phase = 0
+    for sq, piece in gs.occupied_squares():
+        kind = piece[1]
+        sign = 1 if piece[0] == 'w' else -1
+        table_sq = sq if piece[0] == 'w' else sq ^ 56
+        midgame += sign * (MIDGAME_VALUES[kind] + MIDGAME_TABLES[kind][table_sq])
+        endgame += sign * (ENDGAME_VALUES[kind] + ENDGAME_TABLES[kind][table_sq])
+        phase += PHASE_VALUES[kind]
+    return midgame, endgame, phase
+
+
+def evaluate(gs):
+    # blend of the incremental midgame and endgame scores, from the point of view of the side to move
+    if CHECK_INCREMENTAL:
+        expected = compute_scores(gs)
+        actual = (gs.midgame_score, gs.endgame_score, gs.phase)
+        if actual != expected:
+            raise AssertionError(f"incremental evaluation {actual} != recomputed {expected} in {gs.get_fen()}")
+    phase = min(gs.phase, MAX_PHASE)
+    score = (gs.midgame_score * phase + gs.endgame_score * (MAX_PHASE - phase)) // MAX_PHASE
+    return score if gs.white_to_move else -score
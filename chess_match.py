@@ -0,0 +1,183 @@
+# chess_match.py
+import argparse
+import math
+import random
+import time
+from datetime import date
+from multiprocessing import Pool
+from chess_engine import GameState, PIECE_INDEX
+from chess_bot import ChessBot
+from chess_pgn import move_to_san, format_game
+
+MAX_GAME_PLIES = 400  # games still running after this many plies are scored as draws
+MINOR_PIECES = [PIECE_INDEX[piece] for piece in ("wN", "wB", "bN", "bB")]
+MAJOR_PIECES_AND_PAWNS = [PIECE_INDEX[piece] for piece in ("wp", "wR", "wQ", "bp", "bR", "bQ")]
+
+
+def parse_config(name, spec):
+    # "depth=3,nodes=20000,time=0.5,hash=262144" -> search limits for one engine
+    config = {"name": name, "depth": None, "nodes": None, "time": None, "hash": 1 << 18}
+    for item in filter(None, spec.split(",")):
+        key, _, value = item.partition("=")
+        if key not in config or key == "name":
+            raise ValueError(f"unknown engine option: {key}")
+        config[key] = float(value) if key == "time" else int(value)
+    if config["depth"] is None and config["nodes"] is None and config["time"] is None:
+        config["depth"] = 3
+    return config
+
+
+def random_opening(rng, plies):
+    # a FEN reached by random legal moves from the start, retried until the game is still going
+    while True:
+        gs = GameState()
+        for _ in range(plies):
+            moves = gs.get_valid_moves()
+            if not moves:
+                break
+            gs.make_move(rng.choice(moves))
+        if gs.get_valid_moves():
+            return gs.get_fen()
+
+
+def load_openings(path):
+    # one FEN or EPD per line; EPD lines get default clocks
+    openings = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split(";")[0].split()
+            if len(fields) >= 4:
+                openings.append(" ".join(fields[:4] + (fields[4:6] or ["0", "1"])))
+    return openings
+
+
+def game_result(gs, moves):
+    # PGN result and termination reason once the game is over, otherwise None; moves must be the
+    # result of gs.get_valid_moves(), which also sets the draw flags
+    if not moves:
+        if gs.checkmate:
+            return ("0-1" if gs.white_to_move else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if gs.draw_by_fifty_moves:
+        return "1/2-1/2", "fifty-move rule"
+    if gs.draw_by_repetition:
+        return "1/2-1/2", "threefold repetition"
+    counts = gs.piece_counts
+    if not any(counts[i] for i in MAJOR_PIECES_AND_PAWNS) and sum(counts[i] for i in MINOR_PIECES) <= 1:
+        return "1/2-1/2", "insufficient material"
+    if len(gs.move_log) >= MAX_GAME_PLIES:
+        return "1/2-1/2", "adjudication"
+    return None
+
+
+def play_game(job):
+    # runs in a worker process; returns the finished game with per-move search statistics
+    index, fen, white, black = job
+    gs = GameState(fen)
+    bots = {True: ChessBot(white["hash"]), False: ChessBot(black["hash"])}
+    configs = {True: white, False: black}
+    sans, nodes, times = [], [], []
+    while True:
+        moves = gs.get_valid_moves()
+        outcome = game_result(gs, moves)
+        if outcome is not None:
+            break
+        config = configs[gs.white_to_move]
+        max_depth = config["depth"] or 64
+        result = bots[gs.white_to_move].search(gs, max_depth, config["nodes"], config["time"])
+        sans.append(move_to_san(gs, result.best_move, moves))
+        nodes.append(result.nodes)
+        times.append(result.elapsed)
+        gs.make_move(result.best_move)
+    return {"index": index, "fen": fen, "white": white["name"], "black": black["name"],
+            "result": outcome[0], "termination": outcome[1], "sans": sans, "nodes": nodes, "times": times}
+
+
+def elo_estimate(wins, draws, losses):
+    # Elo difference with a 95% confidence interval from the per-game score variance
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, 0.0, 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return _elo(score), _elo(score - margin), _elo(score + margin)
+
+
+def _elo(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def run_match(engine_a, engine_b, games, pgn_path, processes=None, openings=None, opening_plies=8, seed=0):
+    # every opening is played twice with colours swapped; games are written to the PGN as they finish
+    rng = random.Random(seed)
+    jobs = []
+    for pair in range((games + 1) // 2):
+        fen = openings[pair % len(openings)] if openings else random_opening(rng, opening_plies)
+        jobs.append((len(jobs), fen, engine_a, engine_b))
+        jobs.append((len(jobs), fen, engine_b, engine_a))
+    jobs = jobs[:games]
+
+    wins = draws = losses = 0
+    nodes = moves = 0
+    times = []
+    start = time.perf_counter()
+    with open(pgn_path, "w") as pgn, Pool(processes) as pool:
+        for finished, game in enumerate(pool.imap_unordered(play_game, jobs), 1):
+            headers = {"Event": f"{engine_a['name']} vs {engine_b['name']}", "Site": "chess_match",
+                       "Date": date.today().strftime("%Y.%m.%d"), "Round": str(game["index"] + 1),
+                       "White": game["white"], "Black": game["black"], "Termination": game["termination"]}
+            pgn.write(format_game(headers, game["sans"], game["result"], game["fen"]))
+            pgn.flush()
+
+            a_is_white = game["white"] == engine_a["name"]
+            if game["result"] == "1/2-1/2":
+                draws += 1
+            elif (game["result"] == "1-0") == a_is_white:
+                wins += 1
+            else:
+                losses += 1
+            nodes += sum(game["nodes"])
+            moves += len(game["nodes"])
+            times.extend(game["times"])
+            print(f"game {finished}/{len(jobs)}: {game['white']} - {game['black']} {game['result']} "
+                  f"({game['termination']})  +{wins} ={draws} -{losses}")
+    elapsed = time.perf_counter() - start
+
+    elo, low, high = elo_estimate(wins, draws, losses)
+    times.sort()
+    print(f"{engine_a['name']} vs {engine_b['name']}: +{wins} ={draws} -{losses}")
+    print(f"Elo difference: {elo:.1f} (95% CI {low:.1f} to {high:.1f})")
+    print(f"{len(jobs) / elapsed:.2f} games/s, {nodes / moves if moves else 0:.0f} nodes/move")
+    print(f"time/move: p50 {percentile(times, 0.5) * 1000:.1f}ms p90 {percentile(times, 0.9) * 1000:.1f}ms "
+          f"p99 {percentile(times, 0.99) * 1000:.1f}ms")
+    return wins, draws, losses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play engine configurations against each other")
+    parser.add_argument("--engine-a", default="depth=3", help="comma-separated limits: depth, nodes, time, hash")
+    parser.add_argument("--engine-b", default="depth=2")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--pgn", default="match.pgn", help="file the games are streamed to")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--openings", help="file of FEN/EPD start positions, used in turn")
+    parser.add_argument("--opening-plies", type=int, default=8, help="random plies from the start otherwise")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    engine_a = parse_config("A:" + args.engine_a, args.engine_a)
+    engine_b = parse_config("B:" + args.engine_b, args.engine_b)
+    openings = load_openings(args.openings) if args.openings else None
+    run_match(engine_a, engine_b, args.games, args.pgn, args.processes, openings, args.opening_plies, args.seed)
+
+
+if __name__ == "__main__":
+    main()
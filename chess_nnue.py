@@ -0,0 +1,188 @@
+# chess_nnue.py
+import mmap
+import struct
+try:
+    import numpy as np
+except ImportError:  # only needed once a network is loaded
+    np = None
+from chess_engine import PIECES
+
+MAGIC = b"NNUE"
+VERSION = 1
+HEADER_FORMAT = "<4sIIII"  # magic, version, accumulator size, hidden layer sizes
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+KING_SQUARES = 64
+PIECE_KINDS = 10  # pawn to queen, own and enemy
+FEATURES = KING_SQUARES * PIECE_KINDS * 64
+ACTIVATION_MAX = 127
+WEIGHT_SHIFT = 6  # dense layer outputs are scaled down by 2**WEIGHT_SHIFT before the next activation
+OUTPUT_SCALE = 16  # network output units per centipawn
+
+# HalfKP: each side sees the board from its own side, so black's view is mirrored vertically and
+# the colours are swapped. A non-king piece's feature offset is (kind * 64 + square) under that view.
+FEATURE_KINDS = [[-1] * len(PIECES), [-1] * len(PIECES)]
+for _index, _piece in enumerate(PIECES):
+    if _piece[1] != 'K':
+        _kind = "pNBRQ".index(_piece[1])
+        FEATURE_KINDS[0][_index] = _kind + (5 if _piece[0] == 'b' else 0)
+        FEATURE_KINDS[1][_index] = _kind + (5 if _piece[0] == 'w' else 0)
+ORIENT = (0, 56)  # xor applied to squares for each perspective
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("the NNUE evaluation needs numpy installed")
+
+
+def feature_index(perspective, king_sq, piece_index, sq):
+    orient = ORIENT[perspective]
+    return ((king_sq ^ orient) * PIECE_KINDS + FEATURE_KINDS[perspective][piece_index]) * 64 + (sq ^ orient)
+
+
+def active_features(gs, perspective):
+    king_sq = gs.king_squares[perspective]
+    return [feature_index(perspective, king_sq, PIECES.index(piece), sq)
+            for sq, piece in gs.occupied_squares() if piece[1] != 'K']
+
+
+class Accumulator:
+    # First-layer sums for both perspectives, attached to one GameState. _put_piece and _remove_piece
+    # add or subtract a single weight row per perspective; a king move changes every feature of its
+    # own side, so that perspective is marked stale and rebuilt on the next evaluation instead.
+    def __init__(self, network):
+        self.network = network
+        self.values = np.zeros((2, network.size), dtype=np.int16)
+        self.stale = [True, True]
+
+    def __deepcopy__(self, memo):
+        # copies share the (read-only, mapped) network
+        copy = Accumulator(self.network)
+        copy.values[:] = self.values
+        copy.stale = list(self.stale)
+        return copy
+
+    def add_piece(self, gs, piece_index, sq):
+        if piece_index == 5 or piece_index == 11:
+            self.stale[piece_index // 6] = True
+            return
+        weights = self.network.ft_weights
+        for perspective in (0, 1):
+            if not self.stale[perspective]:
+                self.values[perspective] += weights[feature_index(perspective, gs.king_squares[perspective], piece_index, sq)]
+
+    def remove_piece(self, gs, piece_index, sq):
+        if piece_index == 5 or piece_index == 11:
+            self.stale[piece_index // 6] = True
+            return
+        weights = self.network.ft_weights
+        for perspective in (0, 1):
+            if not self.stale[perspective]:
+                self.values[perspective] -= weights[feature_index(perspective, gs.king_squares[perspective], piece_index, sq)]
+
+    def refresh(self, gs):
+        for perspective in (0, 1):
+            if self.stale[perspective]:
+                features = active_features(gs, perspective)
+                self.values[perspective] = self.network.ft_bias
+                if features:
+                    self.values[perspective] += self.network.ft_weights[features].sum(axis=0, dtype=np.int16)
+                self.stale[perspective] = False
+
+
+class NNUENetwork:
+    def __init__(self, path):
+        # The weights are views into the mapped file, so loading copies nothing and several
+        # processes evaluating with the same file share its pages.
+        _require_numpy()
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, hidden1, hidden2 = struct.unpack_from(HEADER_FORMAT, self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} network file")
+        self.size, self.hidden1, self.hidden2 = size, hidden1, hidden2
+        offset = HEADER_SIZE
+        arrays = []
+        for dtype, shape in self.layout(size, hidden1, hidden2):
+            count = 1
+            for dim in shape:
+                count *= dim
+            arrays.append(np.frombuffer(self._map, dtype=dtype, count=count, offset=offset).reshape(shape))
+            offset += count * np.dtype(dtype).itemsize
+        (self.ft_bias, self.ft_weights, self.l1_bias, self.l1_weights,
+         self.l2_bias, self.l2_weights, self.out_bias, self.out_weights) = arrays
+
+    @staticmethod
+    def layout(size, hidden1, hidden2):
+        # (dtype, shape) of every array in file order, all little-endian
+        return [("<i2", (size,)), ("<i2", (FEATURES, size)),
+                ("<i4", (hidden1,)), ("i1", (hidden1, 2 * size)),
+                ("<i4", (hidden2,)), ("i1", (hidden2, hidden1)),
+                ("<i4", (1,)), ("i1", (1, hidden2))]
+
+    def attach(self, gs):
+        gs.accumulator = Accumulator(self)
+        return gs.accumulator
+
+    def evaluate(self, gs):
+        # score in centipawns for the side to move
+        accumulator = gs.accumulator
+        if accumulator is None or accumulator.network is not self:
+            accumulator = self.attach(gs)
+        accumulator.refresh(gs)
+        us = 0 if gs.white_to_move else 1
+        inputs = np.concatenate((accumulator.values[us], accumulator.values[1 - us]))
+        return int(self._forward(inputs[np.newaxis, :])[0])
+
+    def evaluate_batch(self, positions):
+        # scores for many GameStates at once, for labelling training data; accumulators are built
+        # in one gather and sum rather than incrementally
+        rows = [[], []]
+        counts = [[], []]
+        sides = []
+        for gs in positions:
+            us = 0 if gs.white_to_move else 1
+            sides.append(us)
+            for perspective in (0, 1):
+                features = active_features(gs, perspective)
+                rows[perspective].extend(features)
+                counts[perspective].append(len(features))
+        accumulators = []
+        for perspective in (0, 1):
+            sums = np.zeros((len(sides), self.size), dtype=np.int16)
+            owners = np.repeat(np.arange(len(sides)), counts[perspective])
+            np.add.at(sums, owners, self.ft_weights[np.array(rows[perspective], dtype=np.intp)])
+            accumulators.append(sums + self.ft_bias)
+        sides = np.array(sides)
+        ours = np.where(sides[:, np.newaxis] == 0, accumulators[0], accumulators[1])
+        theirs = np.where(sides[:, np.newaxis] == 0, accumulators[1], accumulators[0])
+        return self._forward(np.concatenate((ours, theirs), axis=1))
+
+    def _forward(self, inputs):
+        # inputs: (positions, 2 * size) int16 accumulator values, side to move first
+        hidden = np.clip(inputs, 0, ACTIVATION_MAX).astype(np.int32)
+        hidden = np.matmul(hidden, self.l1_weights.T, dtype=np.int32) + self.l1_bias
+        hidden = np.clip(hidden >> WEIGHT_SHIFT, 0, ACTIVATION_MAX)
+        hidden = np.matmul(hidden, self.l2_weights.T, dtype=np.int32) + self.l2_bias
+        hidden = np.clip(hidden >> WEIGHT_SHIFT, 0, ACTIVATION_MAX)
+        output = np.matmul(hidden, self.out_weights.T, dtype=np.int32) + self.out_bias
+        return output[:, 0] // OUTPUT_SCALE
+
+
+def write_network(path, arrays, size, hidden1, hidden2):
+    # arrays in NNUENetwork.layout order; each is converted to the stored dtype and shape
+    _require_numpy()
+    with open(path, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, size, hidden1, hidden2))
+        for array, (dtype, shape) in zip(arrays, NNUENetwork.layout(size, hidden1, hidden2)):
+            f.write(np.asarray(array).astype(dtype).reshape(shape).tobytes())
+
+
+def random_network(path, size=256, hidden1=32, hidden2=32, seed=0):
+    # untrained weights in the right format, for wiring things up before a trained file exists
+    _require_numpy()
+    rng = np.random.default_rng(seed)
+    arrays = []
+    for dtype, shape in NNUENetwork.layout(size, hidden1, hidden2):
+        bound = 64 if dtype in ("<i2", "i1") else 1024
+        arrays.append(rng.integers(-bound, bound, size=shape))
+    write_network(path, arrays, size, hidden1, hidden2)
@@ -0,0 +1,144 @@
+# chess_perft.py
+import argparse
+import time
+from multiprocessing import Pool
+from chess_engine import GameState, START_FEN
+
+# (name, FEN, published leaf counts by depth)
+PERFT_SUITE = [
+    ("start", START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609, 6: 119060324}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603, 5: 193690690}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624, 6: 11030083}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333, 5: 15833292}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487, 5: 89941194}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594, 5: 164075551}),
+]
+
+
+class PerftTable:
+    def __init__(self, bits=20):
+        # fixed-size table of subtree counts keyed by position hash and remaining depth
+        self.mask = (1 << bits) - 1
+        self.entries = [None] * (1 << bits)
+        self.hits = 0
+
+    def probe(self, key, depth):
+        entry = self.entries[(key ^ depth) & self.mask]
+        if entry is not None and entry[0] == key and entry[1] == depth:
+            self.hits += 1
+            return entry[2]
+        return None
+
+    def store(self, key, depth, count):
+        self.entries[(key ^ depth) & self.mask] = (key, depth, count)
+
+
+def perft(gs, depth, table=None):
+    if depth == 0:
+        return 1
+    if table is not None:
+        count = table.probe(gs.zobrist_key, depth)
+        if count is not None:
+            return count
+    moves = gs.get_valid_moves()
+    if depth == 1:
+        count = len(moves)  # leaves are counted without being made
+    else:
+        count = 0
+        for move in moves:
+            gs.make_move(move)
+            count += perft(gs, depth - 1, table)
+            gs.undo_move()
+    if table is not None:
+        table.store(gs.zobrist_key, depth, count)
+    return count
+
+
+def divide(gs, depth, table=None):
+    # leaf count below each root move, for tracking a mismatch down to the move that causes it
+    results = []
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        results.append((move.get_chess_notation(), perft(gs, depth - 1, table)))
+        gs.undo_move()
+    return results
+
+
+def _divide_worker(args):
+    snapshot, notation, depth, hash_bits = args
+    gs = GameState.from_bytes(snapshot)
+    table = PerftTable(hash_bits) if hash_bits else None
+    return notation, perft(gs, depth - 1, table)
+
+
+def parallel_divide(fen, depth, processes=None, hash_bits=0):
+    # root moves are split across a process pool; each job carries a snapshot of the position
+    # after its root move
+    gs = GameState(fen)
+    jobs = []
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        jobs.append((gs.to_bytes(), move.get_chess_notation(), depth, hash_bits))
+        gs.undo_move()
+    with Pool(processes) as pool:
+        return pool.map(_divide_worker, jobs)
+
+
+def run_perft(fen, depth, show_divide=False, hash_bits=0, processes=1):
+    start = time.perf_counter()
+    if processes > 1 and depth > 1:
+        results = parallel_divide(fen, depth, processes, hash_bits)
+    else:
+        gs = GameState()
+        gs.load_fen(fen)
+        table = PerftTable(hash_bits) if hash_bits else None
+        results = divide(gs, depth, table) if depth > 0 else []
+    nodes = sum(count for _, count in results) if depth > 0 else 1
+    elapsed = time.perf_counter() - start
+    if show_divide:
+        for notation, count in results:
+            print(f"{notation}: {count}")
+    return nodes, elapsed
+
+
+def run_suite(max_depth, hash_bits=0, processes=1):
+    failures = 0
+    for name, fen, expected in PERFT_SUITE:
+        for depth in sorted(expected):
+            if depth > max_depth:
+                break
+            nodes, elapsed = run_perft(fen, depth, hash_bits=hash_bits, processes=processes)
+            status = "OK" if nodes == expected[depth] else f"FAIL (expected {expected[depth]})"
+            if nodes != expected[depth]:
+                failures += 1
+            nps = int(nodes / elapsed) if elapsed > 0 else 0
+            print(f"{name} depth {depth}: {nodes} nodes in {elapsed:.2f}s ({nps} nps) {status}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count leaf nodes of the move generator")
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--divide", action="store_true", help="print the count below each root move")
+    parser.add_argument("--hash", type=int, default=0, metavar="BITS",
+                        help="cache subtree counts in a table of 2**BITS entries")
+    parser.add_argument("--processes", type=int, default=1, help="split root moves across this many processes")
+    parser.add_argument("--suite", action="store_true", help="check the standard positions up to --depth")
+    args = parser.parse_args()
+
+    if args.suite:
+        raise SystemExit(1 if run_suite(args.depth, args.hash, args.processes) else 0)
+    nodes, elapsed = run_perft(args.fen, args.depth, args.divide, args.hash, args.processes)
+    nps = int(nodes / elapsed) if elapsed > 0 else 0
+    print(f"depth {args.depth}: {nodes} nodes in {elapsed:.2f}s ({nps} nps)")
+
+
+if __name__ == "__main__":
+    main()
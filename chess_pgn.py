@@ -0,0 +1,270 @@
+# chess_pgn.py
+import argparse
+import functools
+import re
+import time
+from multiprocessing import Pool
+from chess_engine import GameState, Move, START_FEN
+
+PGN_LINE_LENGTH = 80
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+TAG_RE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_RE = re.compile(r'[{;()]|\$\d+|[^\s{;()$]+')
+MOVE_NUMBER_RE = re.compile(r'^\d+\.*')
+SAN_SUFFIXES = "+#!?"
+
+
+def move_to_san(gs, move, legal_moves=None):
+    # standard algebraic notation for a legal move in the current position
+    if legal_moves is None:
+        legal_moves = gs.get_valid_moves()
+    piece = move.piece_moved
+    if move.is_castle_move:
+        san = "O-O" if move.end_col > move.start_col else "O-O-O"
+    else:
+        destination = move.get_rank_file(move.end_row, move.end_col)
+        capture = move.piece_captured != "--" or move.is_enpassant_move
+        if piece[1] == 'p':
+            san = (move.cols_to_files[move.start_col] + "x" if capture else "") + destination
+            if move.is_pawn_promotion:
+                san += "=" + move.promotion_piece
+        else:
+            # name the origin file, rank or both when another piece of the same kind can reach the square
+            rivals = [other for other in legal_moves if other.piece_moved == piece and
+                      other.end_row == move.end_row and other.end_col == move.end_col and other != move]
+            origin = ""
+            if rivals:
+                if all(other.start_col != move.start_col for other in rivals):
+                    origin = move.cols_to_files[move.start_col]
+                elif all(other.start_row != move.start_row for other in rivals):
+                    origin = move.rows_to_ranks[move.start_row]
+                else:
+                    origin = move.get_rank_file(move.start_row, move.start_col)
+            san = piece[1] + origin + ("x" if capture else "") + destination
+
+    gs.make_move(move)
+    if gs.in_check():
+        gs.get_valid_moves()
+        san += "#" if gs.checkmate else "+"
+    gs.undo_move()
+    return san
+
+
+def format_game(headers, sans, result, start_fen=START_FEN):
+    # one PGN game: the seven tag roster first, then any other tags, then the wrapped movetext
+    tags = dict(headers)
+    tags["Result"] = result
+    if start_fen != START_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = start_fen
+    lines = [f'[{name} "{tags.get(name, "?")}"]' for name in SEVEN_TAG_ROSTER]
+    lines += [f'[{name} "{value}"]' for name, value in tags.items() if name not in SEVEN_TAG_ROSTER]
+    lines.append("")
+
+    fields = start_fen.split()
+    white_to_move = len(fields) < 2 or fields[1] == 'w'
+    move_number = int(fields[5]) if len(fields) > 5 else 1
+    tokens = []
+    for i, san in enumerate(sans):
+        if white_to_move:
+            tokens.append(f"{move_number}.")
+        elif i == 0:
+            tokens.append(f"{move_number}...")
+        tokens.append(san)
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+    tokens.append(result)
+
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > PGN_LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def parse_san(gs, san, legal_moves=None):
+    # the legal move a SAN string names in the current position; ValueError if none or several
+    if legal_moves is None:
+        legal_moves = gs.get_valid_moves()
+    text = san.rstrip(SAN_SUFFIXES)
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        kingside = len(text) == 3
+        for move in legal_moves:
+            if move.is_castle_move and (move.end_col > move.start_col) == kingside:
+                return move
+        raise ValueError(f"illegal move {san} in {gs.get_fen()}")
+
+    promotion = None
+    if "=" in text:
+        text, promotion = text.split("=", 1)
+    elif text and text[-1] in "NBRQ" and text[0].islower():
+        text, promotion = text[:-1], text[-1]
+    if text and text[0] in "NBRQK":
+        kind, text = text[0], text[1:]
+    else:
+        kind = 'p'
+    text = text.replace("x", "").replace("-", "").replace(":", "")
+    if len(text) < 2 or text[-2] not in Move.files_to_cols or text[-1] not in Move.ranks_to_rows:
+        raise ValueError(f"invalid SAN {san}")
+    end_row, end_col = Move.ranks_to_rows[text[-1]], Move.files_to_cols[text[-2]]
+    origin = text[:-2]
+    start_col = Move.files_to_cols.get(origin[0]) if origin and origin[0] in Move.files_to_cols else None
+    start_row = Move.ranks_to_rows.get(origin[-1]) if origin and origin[-1] in Move.ranks_to_rows else None
+
+    found = None
+    for move in legal_moves:
+        if (move.end_row != end_row or move.end_col != end_col or move.piece_moved[1] != kind or
+                move.is_castle_move or (start_col is not None and move.start_col != start_col) or
+                (start_row is not None and move.start_row != start_row)):
+            continue
+        if move.is_pawn_promotion and move.promotion_piece != (promotion or 'Q'):
+            continue
+        if found is not None:
+            raise ValueError(f"ambiguous move {san} in {gs.get_fen()}")
+        found = move
+    if found is None:
+        raise ValueError(f"illegal move {san} in {gs.get_fen()}")
+    return found
+
+
+class PGNGame:
+    def __init__(self, headers, sans, result):
+        self.headers = headers
+        self.sans = sans  # mainline moves only; comments, NAGs and variations are dropped
+        self.result = result
+
+    @property
+    def start_fen(self):
+        return self.headers.get("FEN", START_FEN)
+
+    def replay(self):
+        # GameState after every mainline move has been played, checking each move is legal
+        gs = GameState(self.start_fen)
+        for san in self.sans:
+            gs.make_move(parse_san(gs, san))
+        return gs
+
+
+def read_games(lines):
+    # Yields one PGNGame at a time from any iterable of lines, such as an open file, so only the
+    # game being parsed is ever held in memory.
+    headers = {}
+    sans = []
+    result = "*"
+    in_comment = False
+    variation_depth = 0
+    has_moves = False
+    for line in lines:
+        if in_comment:
+            end = line.find("}")
+            if end < 0:
+                continue
+            line = line[end + 1:]
+            in_comment = False
+        stripped = line.strip()
+        if not stripped or stripped[0] == "%":
+            continue
+        if stripped[0] == "[" and variation_depth == 0:
+            tag = TAG_RE.match(stripped)
+            if tag:
+                if has_moves:
+                    yield PGNGame(headers, sans, result)
+                    headers, sans, result, has_moves = {}, [], "*", False
+                headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+        pos = 0
+        while True:
+            token = TOKEN_RE.search(line, pos)
+            if token is None:
+                break
+            text = token.group()
+            pos = token.end()
+            if text == "{":
+                end = line.find("}", pos)
+                if end < 0:
+                    in_comment = True
+                    break
+                pos = end + 1
+            elif text == ";":
+                break  # comment to the end of the line
+            elif text == "(":
+                variation_depth += 1
+            elif text == ")":
+                variation_depth = max(variation_depth - 1, 0)
+            elif text[0] == "$" or variation_depth:
+                continue
+            elif text in RESULTS:
+                result = text
+                has_moves = True
+            else:
+                text = MOVE_NUMBER_RE.sub("", text)
+                if text:
+                    sans.append(text)
+                    has_moves = True
+    if has_moves or headers:
+        yield PGNGame(headers, sans, result)
+
+
+def _replay_worker(keep_positions, game):
+    # positions and outcome of one game, run in a worker process; a game that cannot be set up
+    # or replayed is reported with its error instead of stopping the import
+    try:
+        gs = GameState(game.start_fen)
+    except ValueError as error:
+        return 0, game.result, [], f"bad FEN header: {error}"
+    try:
+        fens = []
+        for san in game.sans:
+            if keep_positions:
+                fens.append(gs.get_fen())
+            gs.make_move(parse_san(gs, san))
+        return len(game.sans), game.result, fens, None
+    except ValueError as error:
+        return 0, game.result, [], str(error)
+
+
+def import_games(path, processes=None, chunksize=64, keep_positions=False):
+    # replays every game of a PGN file across a process pool, yielding (plies, result,
+    # FEN before each move if keep_positions, error) in completion order
+    worker = functools.partial(_replay_worker, keep_positions)
+    with open(path, encoding="utf-8", errors="replace") as f, Pool(processes) as pool:
+        for replayed in pool.imap_unordered(worker, read_games(f), chunksize):
+            yield replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the games of a PGN file")
+    parser.add_argument("pgn")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--positions", help="write each position as 'FEN | result' to this file")
+    args = parser.parse_args()
+
+    out = open(args.positions, "w") if args.positions else None
+    games = plies = errors = 0
+    results = dict.fromkeys(RESULTS, 0)
+    start = time.perf_counter()
+    for game_plies, result, fens, error in import_games(args.pgn, args.processes, keep_positions=out is not None):
+        games += 1
+        if error is not None:
+            errors += 1
+            continue
+        plies += game_plies
+        results[result] = results.get(result, 0) + 1
+        if out is not None:
+            out.writelines(f"{fen} | {result}\n" for fen in fens)
+    if out is not None:
+        out.close()
+    elapsed = time.perf_counter() - start
+    rate = games / elapsed * 3600 if elapsed > 0 else 0
+    print(f"{games} games ({errors} unreadable), {plies} plies in {elapsed:.1f}s ({rate:.0f} games/hour)")
+    print("results: " + ", ".join(f"{name} {count}" for name, count in results.items()))
+
+
+if __name__ == "__main__":
+    main()
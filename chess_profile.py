@@ -0,0 +1,194 @@
+# chess_profile.py
+import argparse
+import functools
+import inspect
+import json
+import time
+from chess_engine import GameState, Move, START_FEN
+from chess_bot import ChessBot
+
+# Opt-in instrumentation: enable() swaps the GameState methods the search spends its time in,
+# Move.__init__ and ChessBot.search for counting wrappers, and disable() puts the originals back,
+# so nothing is measured (or paid for) while off. Times are inclusive, so a method that calls
+# another counted one includes its time as well; a generator's time is that of its resumptions.
+# get_all_possible_moves and square_under_attack are the row/column entry points the UI and older
+# callers use; the search itself goes through staged_moves, get_capture_moves, see_ge and
+# _attackers_to, so during a bot search the first two usually report few or no calls.
+PROFILED_METHODS = ("get_valid_moves", "get_all_possible_moves", "square_under_attack", "staged_moves",
+                    "get_capture_moves", "see_ge", "_attackers_to", "attacked_squares", "make_move",
+                    "undo_move")
+TIMED = PROFILED_METHODS + ("evaluate", "search")  # evaluate is whatever evaluator the bot searches with
+RATE_INTERVAL = 0.5  # seconds between nodes/sec samples
+
+_originals = {}
+_calls = dict.fromkeys(TIMED, 0)
+_seconds = dict.fromkeys(TIMED, 0.0)
+_counters = {"moves_allocated": 0, "search_nodes": 0}  # nodes of the searches that have finished
+_searching = set()  # bots in the middle of a search, whose own node counters are still running
+_frames = {"count": 0, "total": 0.0, "last": 0.0, "max": 0.0}
+_rate = {"time": 0.0, "nodes": 0, "nodes_per_second": 0.0}
+_started = [0.0]
+
+
+def _timed(name, method):
+    calls, seconds, clock = _calls, _seconds, time.perf_counter
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            seconds[name] += clock() - start
+            calls[name] += 1
+    return wrapper
+
+
+def _timed_generator(name, method):
+    calls, seconds, clock = _calls, _seconds, time.perf_counter
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        calls[name] += 1
+        generator = method(*args, **kwargs)
+        while True:
+            start = clock()
+            try:
+                item = next(generator)
+            except StopIteration:
+                seconds[name] += clock() - start
+                return
+            seconds[name] += clock() - start
+            yield item
+    return wrapper
+
+
+def _profiled_search(search):
+    # times the search, times its evaluator for the duration, and takes nodes from the bot's counter
+    timed_search = _timed("search", search)
+
+    @functools.wraps(search)
+    def wrapper(bot, *args, **kwargs):
+        evaluator = bot.evaluate
+        bot.evaluate = _timed("evaluate", evaluator)
+        _searching.add(bot)
+        try:
+            return timed_search(bot, *args, **kwargs)
+        finally:
+            bot.evaluate = evaluator
+            _searching.discard(bot)
+            _counters["search_nodes"] += bot.nodes
+    return wrapper
+
+
+def _counted_init(init):
+    counters = _counters
+
+    @functools.wraps(init)
+    def wrapper(self, *args, **kwargs):
+        counters["moves_allocated"] += 1
+        init(self, *args, **kwargs)
+    return wrapper
+
+
+def is_enabled():
+    return bool(_originals)
+
+
+def enable():
+    if _originals:
+        return
+    for name in PROFILED_METHODS:
+        method = GameState.__dict__[name]
+        _originals[(GameState, name)] = method
+        wrap = _timed_generator if inspect.isgeneratorfunction(method) else _timed
+        setattr(GameState, name, wrap(name, method))
+    _originals[(Move, "__init__")] = Move.__init__
+    Move.__init__ = _counted_init(Move.__init__)
+    _originals[(ChessBot, "search")] = ChessBot.search
+    ChessBot.search = _profiled_search(ChessBot.search)
+    reset()
+
+
+def disable():
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+
+
+def reset():
+    for name in TIMED:
+        _calls[name] = 0
+        _seconds[name] = 0.0
+    _counters["moves_allocated"] = 0
+    _counters["search_nodes"] = -sum(bot.nodes for bot in _searching)
+    _frames.update(count=0, total=0.0, last=0.0, max=0.0)
+    _started[0] = time.perf_counter()
+    _rate.update(time=_started[0], nodes=0, nodes_per_second=0.0)
+
+
+def record_frame(seconds):
+    # called by the UI with the time one frame took to draw
+    _frames["count"] += 1
+    _frames["total"] += seconds
+    _frames["last"] = seconds
+    _frames["max"] = max(_frames["max"], seconds)
+
+
+def last_frame_ms():
+    return _frames["last"] * 1000
+
+
+def search_nodes():
+    # nodes counted by the searches since the last reset, including any still running
+    return _counters["search_nodes"] + sum(bot.nodes for bot in list(_searching))
+
+
+def nodes_per_second():
+    # search nodes per second, resampled at most every RATE_INTERVAL so a live display stays readable
+    now = time.perf_counter()
+    if now - _rate["time"] >= RATE_INTERVAL:
+        nodes = search_nodes()
+        _rate["nodes_per_second"] = (nodes - _rate["nodes"]) / (now - _rate["time"])
+        _rate["time"], _rate["nodes"] = now, nodes
+    return _rate["nodes_per_second"]
+
+
+def snapshot():
+    # plain dict of every counter, suitable for json.dumps
+    calls = {}
+    for name in TIMED:
+        count, seconds = _calls[name], _seconds[name]
+        calls[name] = {"calls": count, "seconds": seconds,
+                       "microseconds_per_call": seconds / count * 1e6 if count else 0.0}
+    frames = _frames["count"]
+    return {"enabled": is_enabled(), "elapsed": time.perf_counter() - _started[0], "methods": calls,
+            "search_nodes": search_nodes(), "moves_allocated": _counters["moves_allocated"],
+            "frames": {"count": frames, "last_ms": _frames["last"] * 1000, "max_ms": _frames["max"] * 1000,
+                       "mean_ms": _frames["total"] / frames * 1000 if frames else 0.0}}
+
+
+def dump(path=None):
+    # snapshot as JSON, also written to path when one is given
+    text = json.dumps(snapshot(), indent=2)
+    if path is not None:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search one position with the instrumentation enabled")
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--output", help="also write the JSON snapshot to this file")
+    args = parser.parse_args()
+
+    enable()
+    ChessBot().search(GameState(args.fen), args.depth)
+    print(dump(args.output))
+    disable()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+# chess_server.py
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from chess_engine import GameState, START_FEN
+from chess_bot import ChessBot
+from chess_match import percentile
+
+# Line-based JSON over TCP: every request is one JSON object per line with an "op" field and
+# gets one JSON line back; moves, results and flag falls are also pushed as {"event": ...} lines
+# to every connection watching the game.
+DEFAULT_PORT = 8765
+BOT_DEPTH = 4
+BOT_TIME = 1.0  # seconds a bot move may take at most
+CLOCK_SWEEP_INTERVAL = 0.5  # seconds between checks for flag falls in games nobody is moving in
+LATENCY_SAMPLES = 10000  # most recent move requests kept for the latency percentiles
+START_SNAPSHOT = GameState(START_FEN).to_bytes()
+
+log = logging.getLogger("chess_server")
+
+_worker_bot = None
+
+
+def _bot_search(snapshot, moves, depth, time_limit):
+    # runs in a worker process: rebuild the position from the snapshot taken after the last
+    # irreversible move, replay the moves since (so repetitions are seen) and search
+    global _worker_bot
+    if _worker_bot is None:
+        _worker_bot = ChessBot()
+    gs = GameState.from_bytes(snapshot)
+    for notation in moves:
+        legal = {move.get_chess_notation(): move for move in gs.get_valid_moves()}
+        if notation not in legal:
+            raise ValueError(f"cannot replay {notation} in {gs.get_fen()}")
+        gs.make_move(legal[notation])
+    result = _worker_bot.search(gs, depth, time_limit=time_limit)
+    return result.best_move.get_chess_notation() if result.best_move is not None else None
+
+
+def deep_sizeof(obj, seen=None):
+    # bytes held by obj and everything it references that has not been counted yet
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    if hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+
+class GameClock:
+    # Per-game chess clock on the monotonic clock, so it runs without a window or frame loop:
+    # only the side to move's time is running, and each completed move adds the increment.
+    def __init__(self, seconds, increment=0.0):
+        self.remaining = [float(seconds), float(seconds)]  # white, black
+        self.increment = increment
+        self.running = None  # 0 or 1 while a side's time is running
+        self.turn_started = 0.0
+
+    def start(self, white_to_move):
+        self.running = 0 if white_to_move else 1
+        self.turn_started = time.monotonic()
+
+    def press(self, white_to_move):
+        # the side that just moved stops its time; white_to_move is the side now on move. A side
+        # whose flag has already fallen gets no increment, so a late move cannot undo a forfeit.
+        if self.running is not None:
+            self.remaining[self.running] -= time.monotonic() - self.turn_started
+            if self.remaining[self.running] > 0:
+                self.remaining[self.running] += self.increment
+        self.start(white_to_move)
+
+    def stop(self):
+        if self.running is not None:
+            self.remaining[self.running] -= time.monotonic() - self.turn_started
+            self.running = None
+
+    def time_left(self, white):
+        side = 0 if white else 1
+        left = self.remaining[side]
+        if self.running == side:
+            left -= time.monotonic() - self.turn_started
+        return max(left, 0.0)
+
+    def flagged(self):
+        # the side whose time has run out, as 'w' or 'b', or None
+        if self.running is None:
+            return None
+        if self.remaining[self.running] - (time.monotonic() - self.turn_started) <= 0:
+            return 'w' if self.running == 0 else 'b'
+        return None
+
+
+class ServerGame:
+    def __init__(self, game_id, white, black, fen=None, clock=None, depth=BOT_DEPTH):
+        self.game_id = game_id
+        self.players = {True: white, False: black}  # "human" or "bot", by white_to_move
+        self.gs = GameState.from_bytes(GameState(fen).to_bytes() if fen else START_SNAPSHOT)
+        self.clock = clock
+        self.depth = depth
+        self.result = None
+        self.termination = None
+        self.watchers = set()
+        self.bot_pending = False
+        # position after the last capture or pawn move and the moves since, for bot workers
+        self.base_snapshot = self.gs.to_bytes()
+        self.moves_since_base = []
+        self.legal = {}
+        self.refresh_legal_moves()
+
+    def refresh_legal_moves(self):
+        # the legal moves of the current position by notation, so validating a move is one lookup
+        self.legal = {move.get_chess_notation(): move for move in self.gs.get_valid_moves()}
+
+    @property
+    def bot_to_move(self):
+        return self.result is None and self.players[self.gs.white_to_move] == "bot"
+
+    def apply(self, notation):
+        # plays a legal move and returns True; a move that arrives after the mover's flag fell
+        # (before the sweep noticed) is refused and the game is lost on time instead
+        move = self.legal.get(notation)
+        if move is None:
+            return False
+        if self.clock is not None and self.clock.flagged() is not None:
+            self.update_result()
+            return False
+        gs = self.gs
+        gs.make_move(move)
+        if gs.halfmove_clock == 0:
+            self.base_snapshot = gs.to_bytes()
+            self.moves_since_base = []
+        else:
+            self.moves_since_base.append(notation)
+        if self.clock is not None:
+            self.clock.press(gs.white_to_move)
+        self.refresh_legal_moves()
+        self.update_result()
+        return True
+
+    def update_result(self):
+        gs = self.gs
+        if gs.checkmate:
+            self.finish("0-1" if gs.white_to_move else "1-0", "checkmate")
+        elif gs.stalemate:
+            self.finish("1/2-1/2", "stalemate")
+        elif gs.draw_by_repetition:
+            self.finish("1/2-1/2", "threefold repetition")
+        elif gs.draw_by_fifty_moves:
+            self.finish("1/2-1/2", "fifty-move rule")
+        elif self.clock is not None:
+            flagged = self.clock.flagged()
+            if flagged is not None:
+                self.finish("0-1" if flagged == 'w' else "1-0", "time forfeit")
+
+    def finish(self, result, termination):
+        self.result = result
+        self.termination = termination
+        if self.clock is not None:
+            self.clock.stop()
+
+    def state(self):
+        gs = self.gs
+        state = {"game": self.game_id, "fen": gs.get_fen(), "moves": len(gs.move_log),
+                 "to_move": "white" if gs.white_to_move else "black", "result": self.result,
+                 "termination": self.termination}
+        if self.clock is not None:
+            state["clock"] = [round(self.clock.time_left(True), 3), round(self.clock.time_left(False), 3)]
+        return state
+
+
+class GameServer:
+    def __init__(self, processes=None, bot_time=BOT_TIME):
+        self.games = {}
+        self.ids = itertools.count(1)
+        self.pool = ProcessPoolExecutor(processes)
+        self.bot_time = bot_time
+        self.move_times = deque(maxlen=LATENCY_SAMPLES)  # seconds from receiving a move to writing the reply
+        self.moves_served = 0
+        self.tasks = set()  # running bot moves, referenced here so they are not collected mid-flight
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        sweeper = asyncio.create_task(self.sweep_clocks())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
+            self.pool.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        watching = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                received = time.perf_counter()
+                request = None
+                try:
+                    request = json.loads(line)
+                    reply = self.handle(request, writer, watching)
+                except KeyError as error:
+                    reply = {"ok": False, "error": f"missing field {error}"}
+                except (ValueError, TypeError) as error:
+                    reply = {"ok": False, "error": str(error)}
+                self.send(writer, reply)
+                if isinstance(request, dict) and request.get("op") == "move":
+                    # the whole request: validation, the move, legal-move refresh, result and broadcast
+                    self.move_times.append(time.perf_counter() - received)
+                    self.moves_served += 1
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for game_id in watching:
+                game = self.games.get(game_id)
+                if game is not None:
+                    game.watchers.discard(writer)
+            writer.close()
+
+    def handle(self, request, writer, watching):
+        op = request["op"]
+        if op == "new":
+            if not isinstance(request.get("fen", ""), (str, type(None))):
+                raise TypeError("fen must be a string")
+            clock = None
+            if request.get("time") is not None:
+                clock = GameClock(float(request["time"]), float(request.get("increment", 0)))
+            game = ServerGame(next(self.ids), request.get("white", "human"), request.get("black", "bot"),
+                              request.get("fen"), clock, int(request.get("depth", BOT_DEPTH)))
+            self.games[game.game_id] = game
+            game.watchers.add(writer)
+            watching.add(game.game_id)
+            if clock is not None:
+                clock.start(game.gs.white_to_move)
+            self.schedule_bot(game)
+            return {"ok": True, **game.state()}
+        if op == "stats":
+            return {"ok": True, **self.stats(int(request.get("sample", 100)))}
+
+        game = self.games.get(request["game"])
+        if game is None:
+            raise ValueError(f"no game {request['game']}")
+        if op == "move":
+            return self.play_human_move(game, request["move"])
+        if op == "state":
+            return {"ok": True, **game.state(), "legal": sorted(game.legal) if game.result is None else []}
+        if op == "watch":
+            game.watchers.add(writer)
+            watching.add(game.game_id)
+            return {"ok": True, **game.state()}
+        if op == "resign":
+            if game.result is None:
+                game.finish("0-1" if request.get("side", "white") == "white" else "1-0", "resignation")
+                self.broadcast(game, {"event": "result", **game.state()})
+            return {"ok": True, **game.state()}
+        if op == "close":
+            del self.games[game.game_id]
+            return {"ok": True, "game": game.game_id}
+        raise ValueError(f"unknown op {op}")
+
+    def play_human_move(self, game, notation):
+        if game.result is not None:
+            return {"ok": False, "error": "game is over", **game.state()}
+        if game.players[game.gs.white_to_move] != "human":
+            return {"ok": False, "error": "not your move", **game.state()}
+        if notation not in game.legal:
+            return {"ok": False, "error": f"illegal move {notation}", **game.state()}
+        if not game.apply(notation):
+            self.broadcast(game, {"event": "result", **game.state()})
+            return {"ok": False, "error": "time forfeit", **game.state()}
+        self.broadcast(game, {"event": "move", "move": notation, **game.state()})
+        self.schedule_bot(game)
+        return {"ok": True, **game.state()}
+
+    def schedule_bot(self, game):
+        if game.bot_to_move and not game.bot_pending:
+            game.bot_pending = True
+            task = asyncio.get_running_loop().create_task(self.play_bot_move(game))
+            self.tasks.add(task)
+            task.add_done_callback(self.bot_move_done)
+
+    def bot_move_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("bot move task failed", exc_info=task.exception())
+
+    async def play_bot_move(self, game):
+        # the search runs in the process pool; the position it was asked about must still be
+        # current when the answer comes back, or the answer is dropped
+        ply = len(game.gs.move_log)
+        time_limit = self.bot_time
+        if game.clock is not None:
+            time_limit = min(time_limit, game.clock.time_left(game.gs.white_to_move) / 20)
+        loop = asyncio.get_running_loop()
+        error = None
+        try:
+            notation = await loop.run_in_executor(self.pool, _bot_search, game.base_snapshot,
+                                                  list(game.moves_since_base), game.depth, time_limit)
+        except Exception as exception:  # a failed worker must not leave the game waiting forever
+            notation, error = None, f"bot search failed: {exception!r}"
+        finally:
+            game.bot_pending = False
+        if self.games.get(game.game_id) is not game or game.result is not None or len(game.gs.move_log) != ply:
+            return
+        if error is None and notation is not None and game.apply(notation):
+            self.broadcast(game, {"event": "move", "move": notation, **game.state()})
+            self.schedule_bot(game)
+            return
+        if game.result is not None:  # the bot's flag fell while it was searching
+            self.broadcast(game, {"event": "result", **game.state()})
+            return
+        # the bot cannot move: end the game unfinished and tell everyone watching why
+        game.finish("*", "abandoned")
+        self.broadcast(game, {"event": "error", "error": error or f"bot returned no legal move ({notation})"})
+        self.broadcast(game, {"event": "result", **game.state()})
+
+    async def sweep_clocks(self):
+        while True:
+            await asyncio.sleep(CLOCK_SWEEP_INTERVAL)
+            for game in list(self.games.values()):
+                if game.result is None and game.clock is not None and game.clock.flagged() is not None:
+                    game.update_result()
+                    self.broadcast(game, {"event": "result", **game.state()})
+
+    def broadcast(self, game, message):
+        for writer in list(game.watchers):
+            if writer.is_closing():
+                game.watchers.discard(writer)
+            else:
+                self.send(writer, message)
+
+    @staticmethod
+    def send(writer, message):
+        writer.write(json.dumps(message).encode() + b"\n")
+
+    def stats(self, sample=100):
+        # memory is measured on up to `sample` games and averaged, since walking thousands of
+        # positions per request would itself stall the loop
+        games = list(itertools.islice(self.games.values(), sample))
+        footprint = [deep_sizeof(game, {id(writer) for writer in game.watchers}) for game in games]
+        times = sorted(self.move_times)
+        return {"games": len(self.games), "active": sum(game.result is None for game in self.games.values()),
+                "bytes_per_game": int(sum(footprint) / len(footprint)) if footprint else 0,
+                "moves_served": self.moves_served,
+                "move_latency_p50_us": round(percentile(times, 0.5) * 1e6, 1),
+                "move_latency_p99_us": round(percentile(times, 0.99) * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many concurrent games over line-based JSON on TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--processes", type=int, default=None, help="bot search processes (default: one per CPU)")
+    parser.add_argument("--bot-time", type=float, default=BOT_TIME, help="seconds per bot move at most")
+    args = parser.parse_args()
+    try:
+        asyncio.run(GameServer(args.processes, args.bot_time).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+# chess_tablebase.py
+import argparse
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from chess_engine import (GameState, PIECE_INDEX, KNIGHT_ATTACKS, KING_ATTACKS, rook_attacks, bishop_attacks,
+                          WHITE, BLACK, BACK_RANKS)
+
+# File layout: header (magic, material spec such as "KQvKR", entry count, entries per block, block
+# count), then block count + 1 little-endian uint32 file offsets, then the blocks. The entries are
+# stored with every white-to-move one first and the black-to-move ones after (each half compresses
+# better alone than interleaved), cut into zlib-compressed blocks of BLOCK_SIZE entries. A probe maps
+# the file and inflates only the block it needs, keeping the last few inflated blocks of each table.
+MAGIC = b"CTB2"
+HEADER_FORMAT = "<4s12sQII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FILE_SUFFIX = ".ctb"
+BLOCK_SIZE = 8192
+BLOCK_CACHE = 64  # inflated blocks kept per open table
+
+# One byte per position, from the point of view of the side to move:
+# 0 draw, 1..127 win with mate in that many plies, 128 + n lost to mate in n plies, 255 unused index.
+# The index space has an entry for each of the 10 symmetry-reduced white king squares (32 once
+# pawns break the symmetry) times 64^(n-1) placements of the other n-1 pieces times 2 sides to
+# move; 40-55% of those are not canonical legal positions. They are ILLEGAL while generating; in a
+# file they repeat the entry before them, since nothing probes them, so they only lengthen runs
+# the compression removes. On disk the 4-man tables (5,242,880 entries) take KBNvK 1.0 MB and
+# KQvKR 1.3 MB, the smaller ones KQvK 12 KB, KRvK 14 KB and KPvK 34 KB, 13-25% of one byte per
+# entry. En passant and castling rights are ignored, so positions where either matters are looked
+# up as if neither were available.
+DRAW, LOSS, ILLEGAL = 0, 128, 255
+MAX_DTM = 126
+UNREACHED = 255  # "no winning exit move" in the generator's per-position exit bests
+
+PIECE_ORDER = "KQRBNP"
+PIECE_WEIGHTS = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+DEFAULT_SETS = ("KQvK", "KRvK", "KPvK", "KBNvK", "KQvKR")
+
+
+def _square(file, rank):
+    return (7 - rank) * 8 + file
+
+
+def _dihedral_transforms():
+    # the 8 board symmetries as square -> square tables
+    transforms = []
+    for swap in (False, True):
+        for flip_file in (False, True):
+            for flip_rank in (False, True):
+                table = []
+                for sq in range(64):
+                    file, rank = sq & 7, 7 - (sq >> 3)
+                    if swap:
+                        file, rank = rank, file
+                    if flip_file:
+                        file = 7 - file
+                    if flip_rank:
+                        rank = 7 - rank
+                    table.append(_square(file, rank))
+                transforms.append(table)
+    return transforms
+
+
+DIHEDRAL = _dihedral_transforms()
+FILE_MIRROR = [list(range(64)), [sq ^ 7 for sq in range(64)]]
+# white king squares kept after symmetry reduction: the a1-d1-d4 triangle without pawns, files a-d with them
+TRIANGLE = [_square(file, rank) for file in range(4) for rank in range(file + 1)]
+QUEENSIDE = [sq for sq in range(64) if sq & 7 < 4]
+
+
+def material_spec(gs):
+    # "KRvKP": white's pieces, then black's, strongest first
+    counts = gs.piece_counts
+    sides = []
+    for color in "wb":
+        sides.append("".join(letter * counts[PIECE_INDEX[color + (letter if letter != 'P' else 'p')]]
+                             for letter in PIECE_ORDER))
+    return "v".join(sides)
+
+
+def flip_spec(spec):
+    white, black = spec.split("v")
+    return black + "v" + white
+
+
+def normalize_spec(spec):
+    # tables are stored with the side holding more material as white
+    white, black = spec.split("v")
+    if (sum(PIECE_WEIGHTS[p] for p in black), black) > (sum(PIECE_WEIGHTS[p] for p in white), white):
+        return flip_spec(spec)
+    return spec
+
+
+def is_trivial_draw(spec):
+    # a bare king against at most one minor piece can never be mated or mate
+    white, black = normalize_spec(spec).split("v")
+    return black == "K" and white in ("K", "KB", "KN")
+
+
+class TableLayout:
+    # Maps a placement to its index: the white king's reduced square, then every other piece's
+    # square, then the side to move. Among the symmetric images of a position the smallest index
+    # is used, so every image shares one entry.
+    def __init__(self, spec):
+        self.spec = spec
+        white, black = spec.split("v")
+        self.pieces = ["wK", "bK"] + ["w" + (p if p != 'P' else 'p') for p in white[1:]] + \
+                      ["b" + (p if p != 'P' else 'p') for p in black[1:]]
+        self.colors = [WHITE if piece[0] == 'w' else BLACK for piece in self.pieces]
+        self.has_pawns = 'P' in spec
+        self.transforms = FILE_MIRROR if self.has_pawns else DIHEDRAL
+        self.king_squares = QUEENSIDE if self.has_pawns else TRIANGLE
+        self.king_index = [-1] * 64
+        for i, sq in enumerate(self.king_squares):
+            self.king_index[sq] = i
+        # runs of identical pieces, whose squares are sorted so their order does not matter
+        self.groups = []
+        start = 2
+        for i in range(3, len(self.pieces) + 1):
+            if i == len(self.pieces) or self.pieces[i] != self.pieces[start]:
+                if i - start > 1:
+                    self.groups.append((start, i))
+                start = i
+        self.size = len(self.king_squares) * 64 ** (len(self.pieces) - 1) * 2
+
+    def index(self, squares, black_to_move):
+        best = -1
+        for table in self.transforms:
+            king = self.king_index[table[squares[0]]]
+            if king < 0:
+                continue
+            mapped = [table[sq] for sq in squares]
+            for start, end in self.groups:
+                mapped[start:end] = sorted(mapped[start:end])
+            index = king
+            for sq in mapped[1:]:
+                index = index * 64 + sq
+            if best < 0 or index < best:
+                best = index
+        return best * 2 + black_to_move
+
+    def decode(self, index):
+        black_to_move = index & 1
+        index >>= 1
+        squares = []
+        for _ in range(len(self.pieces) - 1):
+            index, sq = divmod(index, 64)
+            squares.append(sq)
+        squares.append(self.king_squares[index])
+        squares.reverse()
+        return squares, black_to_move
+
+    def squares_of(self, gs, flip):
+        # squares of the layout's pieces in gs; flip reads the position with colours swapped
+        squares = []
+        taken = {}
+        for piece in self.pieces:
+            if flip:
+                piece = ('b' if piece[0] == 'w' else 'w') + piece[1]
+            bits = gs.bitboards[PIECE_INDEX[piece]]
+            for _ in range(taken.get(piece, 0)):
+                bits &= bits - 1
+            taken[piece] = taken.get(piece, 0) + 1
+            sq = (bits & -bits).bit_length() - 1
+            squares.append(sq ^ 56 if flip else sq)
+        return squares
+
+
+def _decode_value(value):
+    # (wdl, plies to mate) for the side to move; wdl is 1 win, 0 draw, -1 loss
+    if value == DRAW:
+        return 0, 0
+    if value < LOSS:
+        return 1, value
+    return -1, value - LOSS
+
+
+class Tablebase:
+    def __init__(self, directory):
+        # Files are opened and mapped on first use; a probe inflates (or finds cached) one block.
+        self.directory = directory
+        self.tables = {}
+        self.max_pieces = 0
+        for name in os.listdir(directory):
+            if name.endswith(FILE_SUFFIX):
+                spec = name[:-len(FILE_SUFFIX)]
+                self.tables[spec] = None
+                self.max_pieces = max(self.max_pieces, len(spec) - 1)
+
+    def _open(self, spec):
+        table = self.tables[spec]
+        if table is None:
+            with open(os.path.join(self.directory, spec + FILE_SUFFIX), "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, stored, entries, block_size, blocks = struct.unpack_from(HEADER_FORMAT, data)
+            layout = TableLayout(spec)
+            if magic != MAGIC or stored.rstrip(b"\0").decode() != spec or entries != layout.size:
+                data.close()
+                raise ValueError(f"{spec}{FILE_SUFFIX} is not a tablebase for {spec}")
+            offsets = struct.unpack_from(f"<{blocks + 1}I", data, HEADER_SIZE)
+            table = self.tables[spec] = (layout, data, offsets, block_size, OrderedDict())
+        return table
+
+    @staticmethod
+    def _entry(table, index):
+        layout, data, offsets, block_size, cache = table
+        block, slot = divmod((index >> 1) + (index & 1) * (layout.size >> 1), block_size)
+        values = cache.get(block)
+        if values is None:
+            values = cache[block] = zlib.decompress(data[offsets[block]:offsets[block + 1]])
+            if len(cache) > BLOCK_CACHE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(block)
+        return values[slot]
+
+    def close(self):
+        for spec, table in self.tables.items():
+            if table is not None:
+                table[1].close()
+                self.tables[spec] = None
+
+    def probe(self, gs):
+        # (wdl, plies to mate) for the side to move, or None when no table covers the position.
+        # Castling rights and en passant are not part of the tables.
+        spec = material_spec(gs)
+        if is_trivial_draw(spec):
+            return 0, 0
+        flip = spec not in self.tables
+        if flip:
+            spec = flip_spec(spec)
+            if spec not in self.tables:
+                return None
+        table = self._open(spec)
+        layout = table[0]
+        index = layout.index(layout.squares_of(gs, flip), gs.white_to_move == flip)
+        return _decode_value(self._entry(table, index))
+
+    def best_move(self, gs):
+        # (move, wdl, plies to mate) with the fastest win, else a draw, else the longest loss
+        best = None
+        best_key = None
+        for move in gs.get_valid_moves():
+            gs.make_move(move)
+            replies = gs.get_valid_moves()
+            if not replies:
+                child = (-1, 0) if gs.checkmate else (0, 0)
+            else:
+                child = self.probe(gs)
+            gs.undo_move()
+            if child is None:
+                return None
+            wdl, plies = -child[0], child[1] + 1
+            key = (wdl, -plies if wdl > 0 else plies)
+            if best_key is None or key > best_key:
+                best, best_key = (move, wdl, plies if wdl else 0), key
+        gs.checkmate = gs.stalemate = False
+        return best
+
+
+class TableGenerator:
+    # Builds distance-to-mate tables by retrograde analysis. Every position is set up once on a
+    # GameState to count its legal moves and score the ones that leave the table (captures and
+    # promotions, looked up in smaller tables). Results then spread backwards ply by ply through
+    # un-moves: a loss makes every predecessor a win, and a position is lost once every move
+    # from it has been shown to reach a won position for the opponent.
+    def __init__(self, log=print):
+        self.tables = {}  # spec -> (layout, bytearray) of the tables built so far
+        self.log = log
+
+    def build(self, spec):
+        spec = normalize_spec(spec)
+        if spec in self.tables or is_trivial_draw(spec):
+            return
+        for child in self.dependencies(spec):
+            self.build(child)
+        start = time.perf_counter()
+        layout = TableLayout(spec)
+        self.tables[spec] = (layout, self._generate(layout))
+        self.log(f"{spec}: {layout.size} entries in {time.perf_counter() - start:.1f}s")
+
+    def dependencies(self, spec):
+        # material reachable by one capture or promotion
+        white, black = spec.split("v")
+        children = set()
+        for side, other, is_white in ((white, black, True), (black, white, False)):
+            for i, piece in enumerate(other[1:], 1):
+                reduced = other[:i] + other[i + 1:]
+                children.add(side + "v" + reduced if is_white else reduced + "v" + side)
+            if 'P' in side:
+                for promoted in "QRBN":
+                    grown = "K" + "".join(sorted(side[1:].replace('P', promoted, 1), key=PIECE_ORDER.index))
+                    children.add(grown + "v" + other if is_white else other + "v" + grown)
+        return sorted(normalize_spec(child) for child in children)
+
+    def write(self, spec, directory):
+        spec = normalize_spec(spec)
+        layout, values = self.tables[spec]
+        # white to move, then black to move; unused indexes repeat the entry before them
+        packed = bytearray(values[0::2] + values[1::2])
+        previous = DRAW
+        for index, value in enumerate(packed):
+            if value == ILLEGAL:
+                packed[index] = previous
+            else:
+                previous = value
+        blocks = [zlib.compress(packed[start:start + BLOCK_SIZE], 9)
+                  for start in range(0, len(packed), BLOCK_SIZE)]
+        offsets = [HEADER_SIZE + 4 * (len(blocks) + 1)]
+        for block in blocks:
+            offsets.append(offsets[-1] + len(block))
+        with open(os.path.join(directory, spec + FILE_SUFFIX), "wb") as f:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, spec.encode(), len(values), BLOCK_SIZE, len(blocks)))
+            f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+            for block in blocks:
+                f.write(block)
+
+    def _probe_built(self, gs):
+        # like Tablebase.probe, against the tables held in memory
+        spec = material_spec(gs)
+        if is_trivial_draw(spec):
+            return 0, 0
+        flip = spec not in self.tables
+        if flip:
+            spec = flip_spec(spec)
+        layout, values = self.tables[spec]
+        return _decode_value(values[layout.index(layout.squares_of(gs, flip), gs.white_to_move == flip)])
+
+    def _set_position(self, gs, layout, squares, black_to_move):
+        for sq, _ in list(gs.occupied_squares()):
+            gs._remove_piece(sq)
+        for piece, sq in zip(layout.pieces, squares):
+            gs._put_piece(piece, sq)
+        gs.king_squares = [squares[0], squares[1]]
+        gs.white_to_move = not black_to_move
+
+    def _generate(self, layout):
+        size = layout.size
+        values = bytearray(size)
+        remaining = bytearray(size)  # in-table moves not yet known to lose for the mover
+        exit_win = bytearray([UNREACHED]) * size  # fastest win through a capture or promotion
+        exit_loss = bytearray(size)  # slowest loss through a capture or promotion
+        exit_draw = bytearray(size)
+        pending = [[] for _ in range(MAX_DTM + 2)]
+        pieces = layout.pieces
+        pawn_rows = [i for i, piece in enumerate(pieces) if piece[1] == 'p']
+
+        gs = GameState()
+        gs.castling_rights = 0
+        gs.ep_square = -1
+        for index in range(size):
+            squares, black_to_move = layout.decode(index)
+            if (len(set(squares)) != len(squares) or
+                    any((1 << squares[i]) & BACK_RANKS for i in pawn_rows) or
+                    layout.index(squares, black_to_move) != index):
+                values[index] = ILLEGAL
+                continue
+            self._set_position(gs, layout, squares, black_to_move)
+            mover = BLACK if black_to_move else WHITE
+            if gs.attacked_squares(mover) & (1 << squares[1 - mover]):
+                values[index] = ILLEGAL  # the side that just moved is in check
+                continue
+            moves = gs.get_valid_moves()
+            if not moves:
+                if gs.checkmate:
+                    pending[0].append(index)
+                continue  # stalemate stays a draw
+            children = set()
+            for move in moves:
+                if move.piece_captured != "--" or move.is_pawn_promotion:
+                    gs.make_move(move)
+                    replies = gs.get_valid_moves()
+                    if not replies:
+                        child = (-1, 0) if gs.checkmate else (0, 0)
+                    else:
+                        child = self._probe_built(gs)
+                    gs.undo_move()
+                    if child[0] < 0:
+                        exit_win[index] = min(exit_win[index], child[1] + 1)
+                    elif child[0] > 0:
+                        exit_loss[index] = max(exit_loss[index], child[1] + 1)
+                    else:
+                        exit_draw[index] = 1
+                else:
+                    moved = squares.index(move.start_row * 8 + move.start_col)
+                    after = list(squares)
+                    after[moved] = move.end_row * 8 + move.end_col
+                    children.add(layout.index(after, 1 - black_to_move))
+            remaining[index] = len(children)
+            if exit_win[index] != UNREACHED:
+                pending[exit_win[index]].append(index)
+            elif not children and not exit_draw[index]:
+                pending[exit_loss[index]].append(index)
+
+        for plies in range(MAX_DTM + 1):
+            for index in pending[plies]:
+                if values[index] != DRAW:
+                    continue
+                lost = plies % 2 == 0
+                values[index] = LOSS + plies if lost else plies
+                for parent in self._predecessors(layout, index):
+                    if values[parent] != DRAW:
+                        continue
+                    if lost:
+                        pending[plies + 1].append(parent)
+                    else:
+                        remaining[parent] -= 1
+                        if remaining[parent] == 0 and not exit_draw[parent] and exit_win[parent] == UNREACHED:
+                            pending[min(max(plies + 1, exit_loss[parent]), MAX_DTM + 1)].append(parent)
+        if pending[MAX_DTM + 1]:
+            raise ValueError(f"{layout.spec} has mates longer than {MAX_DTM} plies")
+        return values
+
+    def _predecessors(self, layout, index):
+        # distinct positions one un-move earlier: the side not to move takes back a non-capture
+        squares, black_to_move = layout.decode(index)
+        mover = WHITE if black_to_move else BLACK
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        empty = ~occupied
+        parents = set()
+        for i, piece in enumerate(layout.pieces):
+            if layout.colors[i] != mover:
+                continue
+            sq = squares[i]
+            kind = piece[1]
+            if kind == 'p':
+                step = 8 if mover == WHITE else -8  # a pawn steps back toward its own side
+                origins = 0
+                if (1 << (sq + step)) & empty:
+                    origins = 1 << (sq + step)
+                    home_row = 6 if mover == WHITE else 1
+                    if (sq + 2 * step) >> 3 == home_row and (1 << (sq + 2 * step)) & empty:
+                        origins |= 1 << (sq + 2 * step)
+                origins &= ~BACK_RANKS
+            elif kind == 'N':
+                origins = KNIGHT_ATTACKS[sq] & empty
+            elif kind == 'K':
+                origins = KING_ATTACKS[sq] & empty
+            elif kind == 'B':
+                origins = bishop_attacks(sq, occupied) & empty
+            elif kind == 'R':
+                origins = rook_attacks(sq, occupied) & empty
+            else:
+                origins = (rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)) & empty
+            while origins:
+                lsb = origins & -origins
+                origins ^= lsb
+                before = list(squares)
+                before[i] = lsb.bit_length() - 1
+                parent = layout.index(before, 1 - black_to_move)
+                parents.add(parent)
+        return parents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build distance-to-mate endgame tables")
+    parser.add_argument("specs", nargs="*", default=list(DEFAULT_SETS), help="material such as KQvK or KRvKP")
+    parser.add_argument("--out", default="tablebases", help="directory the tables are written to")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    generator = TableGenerator()
+    for spec in args.specs:
+        generator.build(spec)
+    for spec in generator.tables:
+        generator.write(spec, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# chess_uci.py
+import sys
+import threading
+import time
+from chess_engine import GameState, START_FEN
+from chess_bot import ChessBot, MATE_SCORE, MAX_PLY
+from chess_book import OpeningBook
+from chess_eval import evaluate
+
+ENGINE_NAME = "chess"
+ENGINE_AUTHOR = "kylindreagan"
+MOVE_OVERHEAD = 50  # milliseconds kept back from every clock-based search for I/O
+
+
+class UCIEngine:
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.bot = ChessBot()
+        self.gs = GameState()
+        self.base_fen = START_FEN
+        self.played = []  # UCI strings of the moves applied on top of base_fen
+        self.search_thread = None
+        self.release = threading.Event()  # set once the running search may report its bestmove
+        self.ponder_budget = None  # seconds the pondered search gets from ponderhit on
+        self.handlers = {
+            "uci": self.cmd_uci,
+            "isready": self.cmd_isready,
+            "ucinewgame": self.cmd_ucinewgame,
+            "position": self.cmd_position,
+            "go": self.cmd_go,
+            "stop": self.cmd_stop,
+            "ponderhit": self.cmd_ponderhit,
+            "setoption": self.cmd_setoption,
+        }
+
+    def send(self, line):
+        self.output.write(line + "\n")
+        self.output.flush()
+
+    def handle(self, line):
+        # returns False once the engine should exit
+        tokens = line.split()
+        if not tokens:
+            return True
+        if tokens[0] == "quit":
+            self.cmd_stop(tokens)
+            return False
+        handler = self.handlers.get(tokens[0])
+        if handler is not None:
+            handler(tokens)
+        return True
+
+    def cmd_uci(self, tokens):
+        self.send(f"id name {ENGINE_NAME}")
+        self.send(f"id author {ENGINE_AUTHOR}")
+        self.send("option name BookFile type string default <empty>")
+        self.send("option name EvalFile type string default <empty>")
+        self.send("uciok")
+
+    def cmd_isready(self, tokens):
+        self.send("readyok")
+
+    def cmd_setoption(self, tokens):
+        # setoption name <id> value <x>
+        if "name" not in tokens:
+            return
+        name_end = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[tokens.index("name") + 1:name_end])
+        value = " ".join(tokens[name_end + 1:])
+        if name.lower() == "bookfile":
+            self.cmd_stop(tokens)
+            if self.bot.book is not None:
+                self.bot.book.close()
+            self.bot.book = OpeningBook(value) if value and value != "<empty>" else None
+        elif name.lower() == "evalfile":
+            self.cmd_stop(tokens)
+            if value and value != "<empty>":
+                from chess_nnue import NNUENetwork  # numpy is only needed for a network
+                self.bot.evaluate = NNUENetwork(value).evaluate
+            else:
+                self.bot.evaluate = evaluate
+
+    def cmd_ucinewgame(self, tokens):
+        self.cmd_stop(tokens)
+        self.bot.tt.clear()
+        self.set_position(START_FEN, [])
+
+    def cmd_position(self, tokens):
+        self.cmd_stop(tokens)
+        moves = []
+        if "moves" in tokens:
+            index = tokens.index("moves")
+            moves = tokens[index + 1:]
+            tokens = tokens[:index]
+        if len(tokens) > 1 and tokens[1] == "fen":
+            fen = " ".join(tokens[2:])
+        else:
+            fen = START_FEN
+        self.set_position(fen, moves)
+
+    def set_position(self, fen, moves):
+        # A GUI resends the whole game before every search, so when the base position is unchanged
+        # only the moves past the common prefix are undone or played instead of reloading the FEN.
+        common = 0
+        if fen == self.base_fen:
+            limit = min(len(moves), len(self.played))
+            while common < limit and moves[common] == self.played[common]:
+                common += 1
+            for _ in range(len(self.played) - common):
+                self.gs.undo_move()
+            del self.played[common:]
+        else:
+            self.gs.load_fen(fen)
+            self.base_fen = fen
+            self.played = []
+        for text in moves[common:]:
+            move = self.find_move(text)
+            if move is None:
+                break  # an illegal move ends the line; the position stays at the last legal one
+            self.gs.make_move(move)
+            self.played.append(text)
+
+    def find_move(self, text):
+        for move in self.gs.get_valid_moves():
+            if move.get_chess_notation() == text:
+                return move
+        return None
+
+    def cmd_go(self, tokens):
+        self.cmd_stop(tokens)
+        options = {}
+        i = 1
+        while i < len(tokens):
+            if tokens[i] in ("depth", "nodes", "movetime", "wtime", "btime", "winc", "binc", "movestogo") and i + 1 < len(tokens):
+                options[tokens[i]] = int(tokens[i + 1])
+                i += 2
+            else:
+                i += 1
+        max_depth = options.get("depth", MAX_PLY)
+        time_limit = self.time_budget(options)
+        # An infinite or ponder search must not report bestmove until stop (or ponderhit) arrives,
+        # even when it runs out of depth or finds a mate first; a ponder search only starts its
+        # clock at ponderhit.
+        self.release = threading.Event()
+        self.ponder_budget = None
+        if "infinite" in tokens:
+            time_limit = None
+        elif "ponder" in tokens:
+            self.ponder_budget, time_limit = time_limit, None
+        else:
+            self.release.set()
+        self.search_thread = threading.Thread(target=self.run_search, daemon=True,
+                                              args=(max_depth, options.get("nodes"), time_limit, self.release))
+        self.search_thread.start()
+
+    def time_budget(self, options):
+        # seconds to search, or None to run until depth, nodes or stop ends the search
+        if "movetime" in options:
+            return max(options["movetime"] - MOVE_OVERHEAD, 1) / 1000
+        remaining = options.get("wtime" if self.gs.white_to_move else "btime")
+        if remaining is None:
+            return None
+        increment = options.get("winc" if self.gs.white_to_move else "binc", 0)
+        moves_to_go = options.get("movestogo", 30)
+        budget = min(remaining / moves_to_go + increment * 3 // 4, remaining / 2)
+        return max(budget - MOVE_OVERHEAD, 1) / 1000
+
+    def run_search(self, max_depth, node_limit, time_limit, release):
+        result = self.bot.search(self.gs, max_depth, node_limit, time_limit, self.send_info)
+        release.wait()
+        if result.best_move is None:
+            self.send("bestmove 0000")
+        else:
+            self.send(f"bestmove {result.best_move.get_chess_notation()}")
+
+    def send_info(self, result):
+        if abs(result.score) >= MATE_SCORE - MAX_PLY:
+            plies = MATE_SCORE - abs(result.score)
+            score = f"mate {(plies + 1) // 2 if result.score > 0 else -(plies // 2)}"
+        else:
+            score = f"cp {result.score}"
+        self.send(f"info depth {result.depth} score {score} nodes {result.nodes} nps {result.nps} "
+                  f"time {int(result.elapsed * 1000)} pv {result.pv_notation()}")
+
+    def cmd_ponderhit(self, tokens):
+        # the opponent played the pondered move: the search goes on under the normal time budget
+        if self.search_thread is None or self.release.is_set():
+            return
+        if self.ponder_budget is not None:
+            self.bot.deadline = time.perf_counter() + self.ponder_budget
+        self.release.set()
+
+    def cmd_stop(self, tokens):
+        # search() clears the stop flag when it starts, so keep setting it until the thread is gone
+        self.release.set()
+        while self.search_thread is not None and self.search_thread.is_alive():
+            self.bot.stop()
+            self.search_thread.join(0.01)
+        self.search_thread = None
+
+
+def main():
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 # chess_gui.py
+import os
+import time
 import pygame as p
-from chess_engine import GameState, Move
+import chess_profile
+from chess_engine import GameState, Move, MoveCache, WHITE, BLACK
+from chess_bot import ChessBot
+from chess_book import OpeningBook
+from chess_tablebase import Tablebase
 
 # Increased window width to accommodate sidebar
 BOARD_WIDTH = BOARD_HEIGHT = 512
@@ -10,6 +16,13 @@ HEIGHT = BOARD_HEIGHT
 DIMENSION = 8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15
+BOT_THINK_TIME = 1.0  # seconds the bot may search per move
+BOOK_FILE = "book.bin"  # Polyglot opening book for the bot, used when present
+BOOK_MAX_PLY = 16
+TABLEBASE_DIR = "tablebases"  # endgame tables built by chess_tablebase.py, used when present
+MOVE_CACHE_SIZE = 4096  # legal move lists kept for positions revisited by undo or repetition
+PROFILE_FILE = "profile.json"  # counters written here when profiling is switched off
+SHOW_HANGING_PIECES = True  # tint the side to move's pieces that lose material to a capture
 IMAGES = {}
 
 def load_images():
@@ -160,8 +173,10 @@ def run_game(game_mode, timer_enabled):
     
     # Initialize game
     gs = GameState()
+    gs.move_cache = MoveCache(MOVE_CACHE_SIZE)
     valid_moves = gs.get_valid_moves()
     load_images()
+    renderer = Renderer(screen, game_mode)
     running = True
     sq_selected = ()
     player_clicks = []
@@ -169,6 +184,11 @@ def run_game(game_mode, timer_enabled):
     game_over = False
     player_one = True  # Human plays white
     player_two = (game_mode == "2p")  # Human plays black in 2p mode, bot plays black in 1p mode
+    book = OpeningBook(BOOK_FILE, BOOK_MAX_PLY) if os.path.exists(BOOK_FILE) else None
+    tablebase = Tablebase(TABLEBASE_DIR) if os.path.isdir(TABLEBASE_DIR) else None
+    bot = ChessBot(book=book, tablebase=tablebase)
+    bot_search = None  # handle of the search running in the background, if any
+    bot_failed = False  # the last search raised or returned no move, so the bot cannot play on
     
     # Initialize timer
     move_timer = Timer()
@@ -196,6 +216,8 @@ def run_game(game_mode, timer_enabled):
         
         for e in p.event.get():
             if e.type == p.QUIT:
+                if bot_search is not None:
+                    bot_search.cancel()
                 running = False
                 return "quit"
             elif e.type == p.MOUSEBUTTONDOWN:
@@ -211,7 +233,7 @@ def run_game(game_mode, timer_enabled):
                             sq_selected = (row, col)
                             player_clicks.append(sq_selected)
                         if len(player_clicks) == 2:
-                            move = Move(player_clicks[0], player_clicks[1], gs.board)
+                            move = Move.from_squares(player_clicks[0], player_clicks[1], gs.board)
                             for valid_move in valid_moves:
                                 if move == valid_move:
                                     gs.make_move(valid_move)
@@ -226,9 +248,14 @@ def run_game(game_mode, timer_enabled):
                                 player_clicks = [sq_selected]
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:
+                    # the pending search is for the position being undone
+                    if bot_search is not None:
+                        bot_search.cancel()
+                        bot_search = None
                     gs.undo_move()
                     move_made = True
                     game_over = False
+                    bot_failed = False
                     time_out = False
                     # Reset timer on undo
                     if timer_enabled:
@@ -242,136 +269,280 @@ def run_game(game_mode, timer_enabled):
                         move_timer.start_turn(gs.white_to_move)
                     else:
                         move_timer.reset()
+                elif e.key == p.K_p:
+                    # Toggle the profiling counters and their sidebar readout
+                    if chess_profile.is_enabled():
+                        chess_profile.dump(PROFILE_FILE)
+                        chess_profile.disable()
+                    else:
+                        chess_profile.enable()
                 elif e.key == p.K_ESCAPE:
+                    if bot_search is not None:
+                        bot_search.cancel()
                     return "main_menu"
 
-        # AI move finder logic (for 1p mode)
+        # AI move finder logic (for 1p mode): the search runs on a worker thread and is polled
+        # once per frame, so the window keeps drawing and the timer keeps ticking meanwhile
         if not game_over and not time_out and not human_turn and game_mode == "1p":
-            # TODO: Add your bot logic here
-            # For now, we'll just make a random valid move
-            import random
-            if valid_moves:
-                ai_move = random.choice(valid_moves)
-                gs.make_move(ai_move)
-                move_made = True
-                # Switch timer to next player
-                if timer_enabled:
-                    move_timer.switch_turn(gs.white_to_move)
+            if valid_moves and bot_search is None:
+                bot_search = bot.start_search(gs, time_limit=BOT_THINK_TIME)
+            elif bot_search is not None and bot_search.done():
+                finished, bot_search = bot_search, None
+                ai_move = finished.result.best_move if finished.result is not None else None
+                if ai_move is None:
+                    # the search raised (see finished.error) or found nothing: end the game, not the window
+                    print(f"bot search failed: {finished.error!r}" if finished.error else "bot found no move")
+                    bot_failed = True
+                    game_over = True
+                else:
+                    for valid_move in valid_moves:
+                        if ai_move == valid_move:
+                            gs.make_move(valid_move)
+                            move_made = True
+                            break
+                    # Switch timer to next player
+                    if timer_enabled:
+                        move_timer.switch_turn(gs.white_to_move)
+        elif bot_search is not None:
+            bot_search.cancel()
+            bot_search = None
 
         if move_made:
             valid_moves = gs.get_valid_moves()
             move_made = False
 
-        # Draw everything
-        screen.fill(p.Color("gray"))  # Background for sidebar
-        
-        # Draw board area
-        draw_game_state(screen, gs, valid_moves, sq_selected)
-        
-        # Draw sidebar with all UI elements
-        draw_sidebar(screen, game_mode, gs, timer_enabled, move_timer)
-        
-        # Draw game over messages (on top of everything)
+        # Game over messages
         winner_text = ""
         if time_out:
             winner_text = "Black wins on time!" if gs.white_to_move else "White wins on time!"
-            draw_text(screen, winner_text)
         elif gs.checkmate:
             game_over = True
             winner_text = "Black wins by checkmate" if gs.white_to_move else "White wins by checkmate"
-            draw_text(screen, winner_text)
         elif gs.stalemate:
             game_over = True
             winner_text = "Stalemate"
-            draw_text(screen, winner_text)
+        elif gs.draw_by_repetition:
+            game_over = True
+            winner_text = "Draw by repetition"
+        elif gs.draw_by_fifty_moves:
+            game_over = True
+            winner_text = "Draw by fifty-move rule"
+        elif bot_failed:
+            winner_text = "Bot failed to move"
+
+        # Draw only what changed since the last frame
+        if chess_profile.is_enabled():
+            frame_start = time.perf_counter()
+            renderer.draw(gs, valid_moves, sq_selected, timer_enabled, move_timer, bot_search, winner_text)
+            chess_profile.record_frame(time.perf_counter() - frame_start)
+        else:
+            renderer.draw(gs, valid_moves, sq_selected, timer_enabled, move_timer, bot_search, winner_text)
 
         clock.tick(MAX_FPS)
-        p.display.flip()
     
     p.quit()
     return "main_menu"
 
-def draw_game_state(screen, gs, valid_moves, sq_selected):
-    # Only draw on the board area (left side)
-    board_surface = p.Surface((BOARD_WIDTH, BOARD_HEIGHT))
-    draw_board(board_surface)
-    highlight_squares(board_surface, gs, valid_moves, sq_selected)
-    draw_pieces(board_surface, gs.board)
-    highlight_king_in_check(board_surface, gs)
-    screen.blit(board_surface, (0, 0))
-
-def draw_sidebar(screen, game_mode, gs, timer_enabled, move_timer):
-    sidebar_x = BOARD_WIDTH + 10
-    
-    # Sidebar background
-    sidebar_bg = p.Surface((SIDEBAR_WIDTH - 20, HEIGHT - 20))
-    sidebar_bg.fill(p.Color("lightgray"))
-    screen.blit(sidebar_bg, (sidebar_x, 10))
-    
-    # Game info
-    info_font = p.font.SysFont("helvetica", 18, True, False)
-    small_font = p.font.SysFont("helvetica", 16, False, False)
-    
-    # Game mode
-    mode_text = f"Game Mode: {'1 Player vs AI' if game_mode == '1p' else '2 Players'}"
-    mode_surface = info_font.render(mode_text, True, p.Color("black"))
-    screen.blit(mode_surface, (sidebar_x + 10, 20))
-    
-    # Current turn
-    turn_text = f"Current Turn: {'White' if gs.white_to_move else 'Black'}"
-    turn_surface = info_font.render(turn_text, True, p.Color("black"))
-    screen.blit(turn_surface, (sidebar_x + 10, 50))
-    
-    # Timer status
-    timer_status = "Timer: ENABLED" if timer_enabled else "Timer: DISABLED"
-    timer_status_surface = info_font.render(timer_status, True, p.Color("green") if timer_enabled else p.Color("red"))
-    screen.blit(timer_status_surface, (sidebar_x + 10, 80))
-    
-    # Timer displays
-    if timer_enabled:
-        # White timer
-        white_time_text = f"White: {move_timer.get_formatted_time(True)}"
-        white_surface = small_font.render(white_time_text, True, p.Color("black"))
-        screen.blit(white_surface, (sidebar_x + 10, 120))
-        
-        # Black timer  
-        black_time_text = f"Black: {move_timer.get_formatted_time(False)}"
-        black_surface = small_font.render(black_time_text, True, p.Color("black"))
-        screen.blit(black_surface, (sidebar_x + 10, 150))
-        
+class Renderer:
+    # Draws the board and sidebar incrementally: the board background, fonts, highlight overlays and
+    # static sidebar text are built once, and each frame only repaints the squares and sidebar fields
+    # whose contents changed since the last one.
+    def __init__(self, screen, game_mode):
+        self.screen = screen
+        self.sidebar_x = BOARD_WIDTH + 10
+        self.fonts = {
+            "info": p.font.SysFont("helvetica", 18, True, False),
+            "small": p.font.SysFont("helvetica", 16, False, False),
+            "banner": p.font.SysFont("helvetica", 32, True, False),
+        }
+        self.board_surface = p.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        draw_board(self.board_surface)
+        self.overlays = {}
+        for name, color, alpha in (("selected", "blue", 100), ("target", "green", 100), ("check", "red", 150),
+                                   ("hanging", "orange", 120)):
+            overlay = p.Surface((SQ_SIZE, SQ_SIZE))
+            overlay.set_alpha(alpha)
+            overlay.fill(p.Color(color))
+            self.overlays[name] = overlay
+        self.game_mode = game_mode
+        self.drawn_squares = [None] * 64  # (piece, highlight, in check) as last drawn on each square
+        self.drawn_fields = {}  # sidebar field name -> value it was last drawn with
+        self.drawn_banner = ""
+        self.position = None  # (hash, ply) the check and move highlights were computed for
+        self.selection = None
+        self.in_check = False
+        self.hanging = 0  # bitboard of the side to move's pieces that are en prise
+        self.targets = {}
+        self.dirty = []
+        self.draw_static()
+
+    def draw_static(self):
+        # everything that never changes during a game, drawn once
+        screen = self.screen
+        screen.fill(p.Color("gray"))
+        sidebar_bg = p.Surface((SIDEBAR_WIDTH - 20, HEIGHT - 20))
+        sidebar_bg.fill(p.Color("lightgray"))
+        screen.blit(sidebar_bg, (self.sidebar_x, 10))
+
+        mode_text = f"Game Mode: {'1 Player vs AI' if self.game_mode == '1p' else '2 Players'}"
+        screen.blit(self.fonts["info"].render(mode_text, True, p.Color("black")), (self.sidebar_x + 10, 20))
+
+        controls_y = 200
+        screen.blit(self.fonts["info"].render("Controls:", True, p.Color("darkblue")), (self.sidebar_x + 10, controls_y))
+        controls = [
+            "Z - Undo move",
+            "T - Toggle timer",
+            "P - Toggle profiler",
+            "ESC - Main menu",
+            "Click - Select/move"
+        ]
+        for i, control in enumerate(controls):
+            control_surface = self.fonts["small"].render(control, True, p.Color("black"))
+            screen.blit(control_surface, (self.sidebar_x + 20, controls_y + 30 + i * 25))
+        self.dirty.append(screen.get_rect())
+
+    def draw(self, gs, valid_moves, sq_selected, timer_enabled, move_timer, bot_search, banner):
+        self.update_highlights(gs, valid_moves, sq_selected)
+        self.draw_squares(gs, banner)
+        self.draw_sidebar(gs, timer_enabled, move_timer, bot_search)
+        if self.dirty:
+            p.display.update(self.dirty)
+            self.dirty = []
+
+    def update_highlights(self, gs, valid_moves, sq_selected):
+        # check and move targets only depend on the position and the selection, so they are
+        # recomputed when one of those changes rather than every frame
+        position = (gs.zobrist_key, len(gs.move_log))
+        if position != self.position:
+            self.position = position
+            self.in_check = gs.in_check()
+            if SHOW_HANGING_PIECES:
+                self.hanging = gs.hanging_pieces(WHITE if gs.white_to_move else BLACK)
+            self.selection = None
+        if sq_selected != self.selection:
+            self.selection = sq_selected
+            self.targets = {}
+            if sq_selected != ():
+                r, c = sq_selected
+                piece = gs.board[r][c]
+                if piece != "--" and ((piece[0] == 'w' and gs.white_to_move) or (piece[0] == 'b' and not gs.white_to_move)):
+                    self.targets[r * 8 + c] = "selected"
+                    for move in valid_moves:
+                        if move.start_row == r and move.start_col == c:
+                            self.targets.setdefault(move.end_row * 8 + move.end_col, "target")
+
+    def draw_squares(self, gs, banner):
+        if banner != self.drawn_banner:
+            # the banner spans several squares, so showing or clearing it repaints the whole board
+            self.drawn_banner = banner
+            self.drawn_squares = [None] * 64
+        king_sq = -1
+        if self.in_check:
+            king = gs.find_king('w' if gs.white_to_move else 'b')
+            if king:
+                king_sq = king[0] * 8 + king[1]
+        squares = gs.squares
+        repaint = []
+        for sq in range(64):
+            highlight = self.targets.get(sq) or ("hanging" if self.hanging >> sq & 1 else None)
+            state = (squares[sq], highlight, sq == king_sq)
+            if state != self.drawn_squares[sq]:
+                self.drawn_squares[sq] = state
+                repaint.append(sq)
+        # The banner is translucent, so it is only ever drawn over freshly painted squares: when a
+        # changed square lies under it, every square it covers is repainted and it is drawn once.
+        text_rect = None
+        if banner:
+            text_rect = banner_rect(banner, self.fonts["banner"])
+            if any(square_rect(sq).colliderect(text_rect) for sq in repaint):
+                covered = [sq for sq in range(64) if square_rect(sq).colliderect(text_rect)]
+                repaint = sorted(set(repaint).union(covered))
+            else:
+                text_rect = None
+        for sq in repaint:
+            state = self.drawn_squares[sq]
+            rect = square_rect(sq)
+            self.screen.blit(self.board_surface, rect, rect)
+            if state[1] is not None:
+                self.screen.blit(self.overlays[state[1]], rect)
+            if state[0] != "--":
+                self.screen.blit(IMAGES[state[0]], rect)
+            if state[2]:
+                self.screen.blit(self.overlays["check"], rect)
+            self.dirty.append(rect)
+        if text_rect is not None:
+            draw_text(self.screen, banner, self.fonts["banner"])
+            self.dirty.append(text_rect)
+
+    def draw_field(self, name, rect, value, draw):
+        # repaints one sidebar field when its value differs from what is on screen
+        if self.drawn_fields.get(name, ()) == value:
+            return
+        self.drawn_fields[name] = value
+        self.screen.fill(p.Color("lightgray"), rect)
+        if value is not None:
+            draw(rect)
+        self.dirty.append(rect)
+
+    def blit_lines(self, rect, lines, step):
+        for i, (text, font, color) in enumerate(lines):
+            self.screen.blit(self.fonts[font].render(text, True, p.Color(color)), (rect.x, rect.y + i * step))
+
+    def draw_sidebar(self, gs, timer_enabled, move_timer, bot_search):
+        x = self.sidebar_x
+        state_y = 350
+        turn_text = f"Current Turn: {'White' if gs.white_to_move else 'Black'}"
+        self.draw_field("turn", p.Rect(x + 10, 50, 170, 25), turn_text,
+                        lambda rect: self.blit_lines(rect, [(turn_text, "info", "black")], 0))
+
+        timer_status = "Timer: ENABLED" if timer_enabled else "Timer: DISABLED"
+        self.draw_field("timer_status", p.Rect(x + 10, 80, 170, 25), timer_status,
+                        lambda rect: self.blit_lines(rect, [(timer_status, "info", "green" if timer_enabled else "red")], 0))
+
+        timers = None
+        if timer_enabled:
+            timers = (move_timer.get_formatted_time(True), move_timer.get_formatted_time(False), gs.white_to_move)
+        self.draw_field("timers", p.Rect(x + 5, 113, SIDEBAR_WIDTH - 30, 62), timers,
+                        lambda rect: self.draw_timers(rect, timers))
+
+        profile = None
+        if chess_profile.is_enabled():
+            profile = f"{chess_profile.nodes_per_second() / 1000:.1f}k n/s  frame {chess_profile.last_frame_ms():.1f}ms"
+        self.draw_field("profile", p.Rect(x + 10, 177, 170, 20), profile,
+                        lambda rect: self.blit_lines(rect, [(profile, "small", "darkgreen")], 0))
+
+        check_text = "CHECK!" if self.in_check else None
+        self.draw_field("check", p.Rect(x + 10, state_y, 170, 25), check_text,
+                        lambda rect: self.blit_lines(rect, [(check_text, "info", "red")], 0))
+
+        move_text = f"Moves: {len(gs.move_log)}"
+        self.draw_field("moves", p.Rect(x + 10, state_y + 30, 170, 20), move_text,
+                        lambda rect: self.blit_lines(rect, [(move_text, "small", "black")], 0))
+
+        # Bot search progress
+        thinking = None
+        if bot_search is not None:
+            progress = bot_search.progress
+            thinking = [f"Nodes: {bot_search.nodes}"]
+            if progress is not None:
+                thinking.insert(0, f"Depth: {progress.depth}")
+                if progress.best_move is not None:
+                    thinking.append(f"Best: {progress.best_move.get_chess_notation()}")
+            thinking = tuple(thinking)
+        self.draw_field("thinking", p.Rect(x + 10, state_y + 60, 170, 85), thinking,
+                        lambda rect: self.draw_thinking(rect, thinking))
+
+    def draw_timers(self, rect, timers):
+        white_time, black_time, white_to_move = timers
+        self.blit_lines(p.Rect(rect.x + 5, rect.y + 7, 0, 0), [(f"White: {white_time}", "small", "black"),
+                                                               (f"Black: {black_time}", "small", "black")], 30)
         # Highlight active timer
-        if gs.white_to_move:
-            p.draw.rect(screen, p.Color("yellow"), (sidebar_x + 5, 115, SIDEBAR_WIDTH - 30, 25), 2)
-        else:
-            p.draw.rect(screen, p.Color("yellow"), (sidebar_x + 5, 145, SIDEBAR_WIDTH - 30, 25), 2)
-    
-    # Controls section
-    controls_y = 200
-    controls_title = info_font.render("Controls:", True, p.Color("darkblue"))
-    screen.blit(controls_title, (sidebar_x + 10, controls_y))
-    
-    controls = [
-        "Z - Undo move",
-        "T - Toggle timer", 
-        "ESC - Main menu",
-        "Click - Select/move"
-    ]
-    
-    for i, control in enumerate(controls):
-        control_surface = small_font.render(control, True, p.Color("black"))
-        screen.blit(control_surface, (sidebar_x + 20, controls_y + 30 + i * 25))
-    
-    # Game state info
-    state_y = controls_y + 150
-    if gs.in_check():
-        check_text = "CHECK!"
-        check_surface = info_font.render(check_text, True, p.Color("red"))
-        screen.blit(check_surface, (sidebar_x + 10, state_y))
-    
-    # Move count
-    move_text = f"Moves: {len(gs.move_log)}"
-    move_surface = small_font.render(move_text, True, p.Color("black"))
-    screen.blit(move_surface, (sidebar_x + 10, state_y + 30))
+        box_y = rect.y + 2 if white_to_move else rect.y + 32
+        p.draw.rect(self.screen, p.Color("yellow"), (rect.x, box_y, rect.width, 25), 2)
+
+    def draw_thinking(self, rect, thinking):
+        self.blit_lines(rect, [("Thinking...", "info", "darkblue")], 0)
+        self.blit_lines(p.Rect(rect.x + 10, rect.y + 25, 0, 0), [(line, "small", "black") for line in thinking], 20)
 
 def draw_board(screen):
     colors = [p.Color("burlywood1"), p.Color("saddlebrown")]
@@ -380,45 +551,23 @@ def draw_board(screen):
             color = colors[(r + c) % 2]
             p.draw.rect(screen, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
-def highlight_squares(screen, gs, valid_moves, sq_selected):
-    if sq_selected != ():
-        r, c = sq_selected
-        piece = gs.board[r][c]
-        if piece != "--" and ((piece[0] == 'w' and gs.white_to_move) or (piece[0] == 'b' and not gs.white_to_move)):
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(p.Color("blue"))
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-            s.fill(p.Color("green"))
-            for move in valid_moves:
-                if move.start_row == r and move.start_col == c:
-                    screen.blit(s, (move.end_col * SQ_SIZE, move.end_row * SQ_SIZE))
-
-def highlight_king_in_check(screen, gs):
-    if gs.in_check():
-        king_pos = gs.find_king('w' if gs.white_to_move else 'b')
-        if king_pos:
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(150)
-            s.fill(p.Color("red"))
-            screen.blit(s, (king_pos[1] * SQ_SIZE, king_pos[0] * SQ_SIZE))
-
-def draw_pieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+def square_rect(sq):
+    return p.Rect((sq & 7) * SQ_SIZE, (sq >> 3) * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+
+def banner_rect(text, font):
+    # area draw_text covers: the text plus a 10 pixel margin, centred on the board
+    width, height = font.size(text)
+    return p.Rect(0, 0, width + 20, height + 20).move(BOARD_WIDTH // 2 - (width + 20) // 2,
+                                                      BOARD_HEIGHT // 2 - (height + 20) // 2)
 
-def draw_text(screen, text):
+def draw_text(screen, text, font):
     # Create a semi-transparent background for the text
-    font = p.font.SysFont("helvetica", 32, True, False)
     text_object = font.render(text, 0, p.Color("red"))
     
     # Create background for text
-    text_bg = p.Surface((text_object.get_width() + 20, text_object.get_height() + 20), p.SRCALPHA)
+    text_bg_rect = banner_rect(text, font)
+    text_bg = p.Surface(text_bg_rect.size, p.SRCALPHA)
     text_bg.fill((0, 0, 0, 150))  # Dark semi-transparent background
-    text_bg_rect = text_bg.get_rect(center=(BOARD_WIDTH//2, BOARD_HEIGHT//2))
     
     screen.blit(text_bg, text_bg_rect)
     screen.blit(text_object, (BOARD_WIDTH//2 - text_object.get_width()//2, BOARD_HEIGHT//2 - text_object.get_height()//2))
@@ -0,0 +1,68 @@
+# test_chess_server.py
+import asyncio
+import json
+import time
+import unittest
+from chess_server import GameClock, GameServer, ServerGame
+
+
+class ServerSocketTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = GameServer(processes=1)
+        self.listener = await asyncio.start_server(self.server.handle_connection, "127.0.0.1", 0)
+        port = self.listener.sockets[0].getsockname()[1]
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.listener.close()
+        await self.listener.wait_closed()
+        self.server.pool.shutdown(cancel_futures=True)
+
+    async def request(self, message):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+        await self.writer.drain()
+        return json.loads(await asyncio.wait_for(self.reader.readline(), 5))
+
+    async def test_bad_fen_is_rejected_and_connection_stays_open(self):
+        for fen in ("8/8 w - e", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e9 0 1",
+                    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1", 42):
+            reply = await self.request({"op": "new", "white": "human", "black": "human", "fen": fen})
+            self.assertFalse(reply["ok"])
+            self.assertNotIn("missing field", reply["error"])
+        reply = await self.request({"op": "new", "white": "human", "black": "human"})
+        self.assertTrue(reply["ok"])
+        self.assertEqual(self.server.games.keys(), {reply["game"]})
+
+    async def test_move_latency_covers_served_moves(self):
+        game = (await self.request({"op": "new", "white": "human", "black": "human"}))["game"]
+        event = await self.request({"op": "move", "game": game, "move": "e2e4"})
+        self.assertEqual(event["event"], "move")  # this connection watches the game, so it is told first
+        reply = json.loads(await asyncio.wait_for(self.reader.readline(), 5))
+        self.assertTrue(reply["ok"])
+        stats = await self.request({"op": "stats"})
+        self.assertEqual(stats["moves_served"], 1)
+        self.assertGreater(stats["move_latency_p99_us"], 0)
+
+
+class GameClockTest(unittest.TestCase):
+    def test_move_after_flag_fall_loses_on_time(self):
+        clock = GameClock(0.01, increment=5)
+        game = ServerGame(1, "human", "human", clock=clock)
+        clock.start(True)
+        time.sleep(0.02)
+        self.assertFalse(game.apply("e2e4"))
+        self.assertEqual((game.result, game.termination), ("0-1", "time forfeit"))
+        self.assertEqual(len(game.gs.move_log), 0)
+
+    def test_no_increment_once_flag_has_fallen(self):
+        clock = GameClock(0.01, increment=5)
+        clock.start(True)
+        time.sleep(0.02)
+        clock.press(False)
+        self.assertEqual(clock.time_left(True), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()